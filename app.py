@@ -1,20 +1,244 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, stream_template, jsonify
+from flask import before_render_template, template_rendered, g, stream_with_context
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy import or_, and_, event, create_engine, text, select, update, delete, func, case, bindparam
+from sqlalchemy.exc import OperationalError, IntegrityError
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy import inspect as sqlalchemy_inspect
+from sqlalchemy.orm import joinedload, selectinload, aliased, Session as SQLAlchemySession
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from collections import OrderedDict, namedtuple, deque
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.datastructures import CallbackDict
 import os
 from functools import wraps
 import random
 import string
+import calendar
+import secrets
+import sqlite3
+import hashlib
+import heapq
+import bisect
+import itertools
+import math
+import re
+import zlib
+import statistics
+import subprocess
+import sys
+import time
+import tempfile
+import threading
+import csv
+import io
+import json
+import queue
+import urllib.request
+import click
+try:
+    import fcntl
+except ImportError: # Windows: snapshot refreshes are then only serialized within a process
+    fcntl = None
 
 app = Flask(__name__)
 
 # --- Configuration ---
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bank.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///bank.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool settings, only passed on when set, e.g. DB_POOL_SIZE=10 DB_POOL_RECYCLE=3600
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    option: int(os.environ[variable])
+    for option, variable in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                             ('pool_timeout', 'DB_POOL_TIMEOUT'), ('pool_recycle', 'DB_POOL_RECYCLE'))
+    if variable in os.environ
+}
+if os.environ.get('DB_POOL_PRE_PING') == '1':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'] = True
+# On SQLite files: WAL journal, synchronous=NORMAL, a busy timeout and memory-mapped reads,
+# applied to every new connection. SQLITE_PROFILE=0 keeps SQLite's defaults.
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', '1') == '1'
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Where the admin listing and report pages read from: 'off' (the primary), 'snapshot' (a copy of
+# the SQLite database refreshed once it is older than REPLICA_MAX_STALENESS seconds) or 'bind'
+# (REPLICA_DATABASE_URL, kept up to date by something else).
+app.config['REPLICA_MODE'] = os.environ.get('REPLICA_MODE', 'off')
+app.config['REPLICA_MAX_STALENESS'] = int(os.environ.get('REPLICA_MAX_STALENESS', '60'))
+app.config['REPLICA_SNAPSHOT_PATH'] = os.environ.get('REPLICA_SNAPSHOT_PATH', os.path.join(app.instance_path, 'bank-replica.db'))
+if app.config['REPLICA_MODE'] == 'snapshot':
+    # No pooling, so a refreshed snapshot file is picked up by the next connection
+    app.config['SQLALCHEMY_BINDS'] = {'replica': {'url': 'sqlite:///' + app.config['REPLICA_SNAPSHOT_PATH'], 'poolclass': NullPool}}
+elif app.config['REPLICA_MODE'] == 'bind':
+    app.config['SQLALCHEMY_BINDS'] = {'replica': os.environ['REPLICA_DATABASE_URL']}
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a_very_secret_key_that_is_hard_to_guess')
-
-db = SQLAlchemy(app)
+# werkzeug method string with its cost parameters, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'.
+# Changing it upgrades stored hashes as users log in.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+# Number of processes to hash and verify passwords in; 0 hashes inline in the request.
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '0'))
+# Where sessions live: 'cookie' (Flask's signed cookie sessions), 'sqlite' (server-side, in a
+# file shared by all workers on this host) or 'memory' (server-side, per process)
+app.config['SESSION_STORE'] = os.environ.get('SESSION_STORE', 'cookie')
+# Where cached customer context lives: 'sqlite', 'memory' or 'off'
+app.config['CUSTOMER_CONTEXT_STORE'] = os.environ.get('CUSTOMER_CONTEXT_STORE', 'sqlite')
+app.config['SESSION_STORE_PATH'] = os.environ.get('SESSION_STORE_PATH', os.path.join(app.instance_path, 'sessions.db'))
+app.config['CUSTOMER_CONTEXT_TTL'] = int(os.environ.get('CUSTOMER_CONTEXT_TTL', '300'))
+# Where posting events from the outbox go: a comma-separated list of 'file', 'queue' and 'webhook'.
+# None by default: events are marked dispatched and purged after OUTBOX_RETENTION_DAYS. The
+# file sink is never rotated, so only turn it on with something else rotating the file.
+app.config['OUTBOX_SINKS'] = os.environ.get('OUTBOX_SINKS', '')
+app.config['OUTBOX_FILE_PATH'] = os.environ.get('OUTBOX_FILE_PATH', os.path.join(app.instance_path, 'outbox.ndjson'))
+app.config['OUTBOX_WEBHOOK_URL'] = os.environ.get('OUTBOX_WEBHOOK_URL', 'http://127.0.0.1:8080/events')
+# 'thread' runs a dispatcher in every server process; 'off' leaves it to the dispatch-outbox command
+app.config['OUTBOX_DISPATCHER'] = os.environ.get('OUTBOX_DISPATCHER', 'thread')
+app.config['OUTBOX_BATCH_SIZE'] = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+app.config['OUTBOX_LEASE_SECONDS'] = int(os.environ.get('OUTBOX_LEASE_SECONDS', '30'))
+app.config['OUTBOX_POLL_SECONDS'] = float(os.environ.get('OUTBOX_POLL_SECONDS', '5'))
+app.config['OUTBOX_RETENTION_DAYS'] = int(os.environ.get('OUTBOX_RETENTION_DAYS', '7'))
+# Velocity limits on customer withdrawals and transfers. Amounts are in rupees here.
+app.config['VELOCITY_CHECKS'] = os.environ.get('VELOCITY_CHECKS', '1') == '1'
+app.config['VELOCITY_WINDOW_SECONDS'] = int(os.environ.get('VELOCITY_WINDOW_SECONDS', '3600'))
+app.config['VELOCITY_ACCOUNT_MAX_COUNT'] = int(os.environ.get('VELOCITY_ACCOUNT_MAX_COUNT', '20'))
+app.config['VELOCITY_ACCOUNT_MAX_AMOUNT'] = int(os.environ.get('VELOCITY_ACCOUNT_MAX_AMOUNT', '200000'))
+app.config['VELOCITY_CUSTOMER_MAX_COUNT'] = int(os.environ.get('VELOCITY_CUSTOMER_MAX_COUNT', '40'))
+app.config['VELOCITY_CUSTOMER_MAX_AMOUNT'] = int(os.environ.get('VELOCITY_CUSTOMER_MAX_AMOUNT', '500000'))
+app.config['VELOCITY_NEW_PAYEE_MAX_AMOUNT'] = int(os.environ.get('VELOCITY_NEW_PAYEE_MAX_AMOUNT', '25000'))
+app.config['VELOCITY_NEW_PAYEES_PER_WINDOW'] = int(os.environ.get('VELOCITY_NEW_PAYEES_PER_WINDOW', '3'))
+# How often each process saves its new velocity events and picks up those of other processes
+app.config['VELOCITY_SYNC_SECONDS'] = float(os.environ.get('VELOCITY_SYNC_SECONDS', '5'))
+# How long a money-moving POST can be safely retried with the same Idempotency-Key
+app.config['IDEMPOTENCY_KEY_TTL_HOURS'] = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Requests slower than this are logged with their slowest SQL statements; 0 turns the log off
+app.config['SLOW_REQUEST_MS'] = int(os.environ.get('SLOW_REQUEST_MS', '500'))
+# Lets a scraper read /admin/metrics with 'Authorization: Bearer <token>' instead of an admin login
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """Sends reads to the 'replica' bind inside views marked with @replica_reads. Flushes always go to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and g and g.get('read_from_replica'):
+            engines = self._db.engines
+            if 'replica' in engines:
+                return engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+# --- Storage Profile ---
+SQLITE_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+def apply_sqlite_profile(dbapi_connection, config):
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SQLITE_SYNCHRONOUS_MODES)}")
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers carry on while a writer commits; it is stored in the file, the rest is per connection
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute(f'PRAGMA synchronous={synchronous}')
+    cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+    cursor.close()
+
+def enable_sqlite_profile(flask_app):
+    """Applies the SQLite profile to every connection the app's engine opens. Call before the first query."""
+    if not flask_app.config['SQLITE_PROFILE']:
+        return
+    with flask_app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+    config = flask_app.config
+    event.listen(engine, 'connect', lambda dbapi_connection, connection_record: apply_sqlite_profile(dbapi_connection, config))
+
+enable_sqlite_profile(app)
+
+# --- Money ---
+# All money is held as whole paise in integers (₹12.34 is 1234), both in the database
+# and in Python, so sums and comparisons are exact and never drift like floats.
+
+class Paise(TypeDecorator):
+    """Integer column type for money amounts. Rejects floats so rupee values can't slip in unconverted."""
+    impl = db.BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, float):
+            raise TypeError(f"Money must be given in integer paise, not float {value!r}")
+        return value
+
+def parse_rupees(value):
+    """Converts user input such as '1,250.5' to paise (125050). Raises ValueError for anything else."""
+    try:
+        amount = Decimal(str(value).strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"Not a rupee amount: {value!r}")
+    if not amount.is_finite() or amount.as_tuple().exponent < -2:
+        raise ValueError(f"Not a rupee amount: {value!r}")
+    return int(amount * 100)
+
+def format_rupees(paise):
+    sign = '-' if paise < 0 else ''
+    rupees, remainder = divmod(abs(paise), 100)
+    return f"{sign}{rupees}.{remainder:02d}"
+
+app.add_template_filter(format_rupees, 'rupees')
+
+# --- Password Hashing ---
+# Password hashes are deliberately slow. With PASSWORD_HASH_WORKERS set, hashing and
+# verification run in a process pool, so a burst of logins is spread over all cores
+# instead of stalling the threads of the worker that received them.
+
+password_hash_pool = None
+password_hash_pool_lock = threading.Lock() # So concurrent first logins don't each build a pool
+password_hash_prefix = None
+
+def run_password_hashing(function, *args):
+    global password_hash_pool
+    if not app.config['PASSWORD_HASH_WORKERS']:
+        return function(*args)
+    if password_hash_pool is None:
+        with password_hash_pool_lock:
+            if password_hash_pool is None:
+                # Created on first use, so each forked server worker gets its own pool
+                password_hash_pool = ProcessPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'])
+    return password_hash_pool.submit(function, *args).result()
+
+def hash_password(password):
+    return run_password_hashing(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    return run_password_hashing(check_password_hash, password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """True when a stored hash was made with other parameters than PASSWORD_HASH_METHOD."""
+    global password_hash_prefix
+    if password_hash_prefix is None:
+        # werkzeug fills in defaults ('pbkdf2' -> 'pbkdf2:sha256:<iterations>'), so compare with a real hash
+        password_hash_prefix = generate_password_hash('', app.config['PASSWORD_HASH_METHOD']).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != password_hash_prefix
+
+def rehash_password_if_needed(user, password):
+    # Called right after a successful login, the only time the plain password is available
+    if password_needs_rehash(user.password_hash):
+        user.set_password(password)
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error upgrading password hash: {e}")
 
 # --- Database Models ---
 class Customer(db.Model):
@@ -22,16 +246,16 @@ class Customer(db.Model):
     name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(200))
     contact_info = db.Column(db.String(100), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
 
     accounts = db.relationship('Account', backref='customer', lazy=True, cascade="all, delete-orphan") # Added cascade for deletion
     loans = db.relationship('Loan', backref='customer', lazy=True, cascade="all, delete-orphan") # Added cascade for deletion
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def __repr__(self):
         return f"<Customer {self.name}>"
@@ -41,12 +265,17 @@ class Account(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
     account_number = db.Column(db.String(20), unique=True, nullable=False)
     account_type = db.Column(db.String(50), nullable=False)
-    balance = db.Column(db.Float, default=0.0)
+    balance = db.Column(Paise, default=0, nullable=False)
     opening_date = db.Column(db.DateTime, default=datetime.utcnow)
 
     transactions = db.relationship('Transaction', backref='account', lazy=True, foreign_keys='[Transaction.account_id]', cascade="all, delete-orphan") # Added cascade
     outgoing_transfers = db.relationship('Transaction', backref='target_account', lazy=True, foreign_keys='[Transaction.target_account_id]')
 
+    __table_args__ = (
+        db.Index('ix_account_customer_id', customer_id),
+        {'sqlite_autoincrement': True}, # Ids of deleted accounts are never handed out again
+    )
+
 
     def __repr__(self):
         return f"<Account {self.account_number}>"
@@ -55,10 +284,17 @@ class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     transaction_type = db.Column(db.String(50), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Paise, nullable=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
     description = db.Column(db.String(200))
     target_account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
+    balance_after = db.Column(Paise, nullable=True) # Balance of account_id once this posting applied
+
+    __table_args__ = (
+        db.Index('ix_transaction_account_id_date', account_id, date.desc()), # Account statements, customer details
+        db.Index('ix_transaction_date_id', date.desc(), id.desc()), # Admin ledger keyset pagination
+        db.Index('ix_transaction_target_account_id', target_account_id), # Incoming transfer legs
+    )
 
     def __repr__(self):
         return f"<Transaction {self.transaction_type} on {self.date}>"
@@ -67,30 +303,424 @@ class Loan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
-    loan_amount = db.Column(db.Float, nullable=False)
+    loan_amount = db.Column(Paise, nullable=False)
     interest_rate = db.Column(db.Float, nullable=False)
     term_months = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(50), default='Pending', nullable=False)
     application_date = db.Column(db.DateTime, default=datetime.utcnow)
     approval_date = db.Column(db.DateTime, nullable=True)
+    installments_paid = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    account = db.relationship('Account', lazy=True) # Disbursement account, used by the loan templates
+
+    __table_args__ = (
+        db.Index('ix_loan_status_application_date', status, application_date), # Pending counts, loan listings
+        db.Index('ix_loan_customer_id', customer_id),
+        db.Index('ix_loan_account_id', account_id),
+    )
+
+    @property
+    def monthly_installment(self):
+        """None for a loan whose stored terms can't be amortized."""
+        try:
+            return installment_amount(self.loan_amount, self.interest_rate, self.term_months)
+        except InvalidLoanTermsError:
+            return None
 
     def __repr__(self):
         return f"<Loan {self.id} - {self.status}>"
 
+class LoanRepayment(db.Model):
+    # One row per installment the repayment run has attempted; (loan_id, installment_number)
+    # is unique, so an installment can never be collected twice.
+    id = db.Column(db.Integer, primary_key=True)
+    loan_id = db.Column(db.Integer, db.ForeignKey('loan.id'), nullable=False)
+    installment_number = db.Column(db.Integer, nullable=False)
+    due_date = db.Column(db.DateTime, nullable=False)
+    amount = db.Column(Paise, nullable=False)
+    status = db.Column(db.String(20), nullable=False) # 'Paid' or 'Missed'
+    attempted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
+
+    loan = db.relationship('Loan', backref=db.backref('repayments', lazy=True, cascade="all, delete-orphan", order_by='LoanRepayment.installment_number'))
+    transaction = db.relationship('Transaction')
+
+    __table_args__ = (
+        db.UniqueConstraint('loan_id', 'installment_number', name='uq_loan_repayment_installment'),
+    )
+
+    def __repr__(self):
+        return f"<LoanRepayment loan {self.loan_id} #{self.installment_number} {self.status}>"
+
+class BalanceSnapshot(db.Model):
+    # An account's balance at the start of as_of, taken by the snapshot-balances command.
+    # Balance-as-of queries start from the nearest snapshot and read forward from there.
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    as_of = db.Column(db.DateTime, nullable=False)
+    balance = db.Column(Paise, nullable=False)
+
+    account = db.relationship('Account', backref=db.backref('balance_snapshots', lazy=True, cascade="all, delete-orphan"))
+
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'as_of', name='uq_balance_snapshot_account_as_of'),
+    )
+
+    def __repr__(self):
+        return f"<BalanceSnapshot account {self.account_id} at {self.as_of}>"
+
 class Admin(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def __repr__(self):
         return f"<Admin {self.username}>"
 
+class OutboxEvent(db.Model):
+    # An event for other systems, committed together with the change it describes and
+    # delivered afterwards by the outbox dispatcher. dispatched_at stays NULL until every
+    # sink has accepted it; claimed_until is the lease of the dispatcher working on it.
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='SET NULL'), nullable=True)
+    payload = db.Column(db.Text, nullable=False) # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claimed_until = db.Column(db.DateTime, nullable=True)
+    claim_token = db.Column(db.String(32), nullable=True)
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.String(500), nullable=True)
+
+    transaction = db.relationship('Transaction')
+
+    __table_args__ = (
+        db.Index('ix_outbox_event_dispatched_at_id', dispatched_at, id), # Undelivered events, oldest first
+        db.Index('ix_outbox_event_claim_token', claim_token),
+    )
+
+    def __repr__(self):
+        return f"<OutboxEvent {self.id} {self.event_type}>"
+
+class VelocityEvent(db.Model):
+    # One debit counted by a velocity window, shared so every worker process (and a
+    # restarted one) counts the debits the others have seen
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), nullable=False) # e.g. 'account:12', 'customer:7'
+    occurred_at = db.Column(db.Float, nullable=False) # Unix time
+    amount = db.Column(Paise, nullable=False)
+    origin = db.Column(db.String(32), nullable=False) # The process that recorded it
+
+    __table_args__ = (
+        db.Index('ix_velocity_event_occurred_at', occurred_at), # Pruning
+    )
+
+    def __repr__(self):
+        return f"<VelocityEvent {self.key} {self.amount}>"
+
+class IdempotencyKey(db.Model):
+    # The outcome of a deposit, withdrawal or transfer, committed together with its posting,
+    # so a retried request with the same key gets the same answer instead of a second posting
+    id = db.Column(db.Integer, primary_key=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), nullable=False)
+    key = db.Column(db.String(64), nullable=False) # sha256 of the client's key
+    fingerprint = db.Column(db.String(64), nullable=False) # sha256 of the operation and its form fields
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='SET NULL'), nullable=True)
+    result_message = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    customer = db.relationship('Customer', backref=db.backref('idempotency_keys', cascade='all, delete-orphan'))
+    transaction = db.relationship('Transaction')
+
+    __table_args__ = (
+        db.UniqueConstraint('customer_id', 'key', name='uq_idempotency_key_customer_key'),
+        db.Index('ix_idempotency_key_created_at', created_at), # Expiry
+    )
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.customer_id} {self.key[:8]}>"
+
+class SchemaMigration(db.Model):
+    # One row per migration in MIGRATIONS that has been applied to this database
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaMigration {self.version}>"
+
+class BankCounter(db.Model):
+    # Materialized totals shown on the admin dashboard, e.g. name='customers'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<BankCounter {self.name}={self.value}>"
+
+
+# --- Dashboard Counters ---
+# The dashboard totals are read from bank_counter instead of running COUNT(*) over
+# whole tables. Every view that adds or removes a counted row calls adjust_counter()
+# before its commit, so the counter moves in the same transaction as the row.
+
+def actual_counter_values(connection):
+    return {
+        'customers': connection.execute(select(func.count()).select_from(Customer.__table__)).scalar(),
+        'accounts': connection.execute(select(func.count()).select_from(Account.__table__)).scalar(),
+        'pending_loans': connection.execute(
+            select(func.count()).select_from(Loan.__table__).where(Loan.__table__.c.status == 'Pending')).scalar(),
+    }
+
+def rebuild_counters(connection):
+    values = actual_counter_values(connection)
+    connection.execute(delete(BankCounter.__table__).where(BankCounter.__table__.c.name.in_(list(values))))
+    connection.execute(BankCounter.__table__.insert(), [{'name': name, 'value': value} for name, value in values.items()])
+    return values
+
+def adjust_counter(name, delta):
+    if delta:
+        db.session.execute(update(BankCounter).where(BankCounter.name == name).values(value=BankCounter.value + delta))
+
+def read_counters():
+    return dict(db.session.query(BankCounter.name, BankCounter.value).all())
+
+@app.cli.command('rebuild-counters')
+@click.option('--check', is_flag=True, help='Only compare the counters with the real tables.')
+def rebuild_counters_command(check):
+    """Rebuild the dashboard counters from the real tables, or verify them with --check."""
+    with db.engine.begin() as connection:
+        stored = dict(connection.execute(select(BankCounter.__table__.c.name, BankCounter.__table__.c.value)).all())
+        actual = actual_counter_values(connection)
+        mismatches = {name: (stored.get(name), value) for name, value in actual.items() if stored.get(name) != value}
+
+        for name, (stored_value, actual_value) in mismatches.items():
+            print(f"{name}: stored {stored_value}, actual {actual_value}")
+
+        if check:
+            if mismatches:
+                raise SystemExit(1)
+            print("Counters match the tables.")
+            return
+
+        rebuild_counters(connection)
+        print(f"Counters rebuilt: {actual}")
+
+
+# --- Schema Migrations ---
+# db.create_all() only creates missing tables; it never changes tables that already
+# exist in bank.db. Changes to existing tables go here as numbered, idempotent steps
+# that run once per database, in order, at startup (or via `flask migrate-db`).
+
+def create_missing_indexes(connection):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def add_missing_columns(table_name, *column_names):
+    """Returns a migration step adding model columns that an older table doesn't have yet.
+
+    The columns need to be nullable or have a server_default.
+    """
+    def migrate(connection):
+        existing = {column['name'] for column in sqlalchemy_inspect(connection).get_columns(table_name)}
+        table = db.metadata.tables[table_name]
+        quoted_table = connection.dialect.identifier_preparer.quote(table_name)
+        for name in column_names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            ddl = f"ALTER TABLE {quoted_table} ADD COLUMN {name} {column.type.compile(connection.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            connection.execute(text(ddl))
+    return migrate
+
+MONEY_COLUMNS = {'account': ('balance',), 'transaction': ('amount',), 'loan': ('loan_amount',)}
+
+def convert_money_to_paise(connection):
+    """Converts float rupee columns from older databases to integer paise.
+
+    Prints every value that was not a whole number of paise, i.e. where rounding
+    changed the stored amount.
+    """
+    inspector = sqlalchemy_inspect(connection)
+    for table_name, money_columns in MONEY_COLUMNS.items():
+        column_types = {column['name']: column['type'] for column in inspector.get_columns(table_name)}
+        if not any(isinstance(column_types[name], db.Float) for name in money_columns):
+            continue # Created with integer columns already
+
+        table = db.metadata.tables[table_name]
+        quoted_table = connection.dialect.identifier_preparer.quote(table_name)
+        for name in money_columns:
+            inexact = connection.execute(text(
+                f"SELECT id, {name} FROM {quoted_table} WHERE ABS({name} * 100 - ROUND({name} * 100)) > 1e-6")).all()
+            for row_id, value in inexact:
+                print(f"Rounding {table_name}.{name} for id {row_id}: {value!r} -> {round(value * 100)} paise")
+            print(f"{table_name}.{name}: {len(inexact)} value(s) rounded")
+
+        if connection.dialect.name == 'sqlite':
+            # SQLite can't change a column's type: copy into a new table and swap it in
+            scratch_metadata = db.MetaData()
+            for other_table in db.metadata.sorted_tables:
+                other_table.to_metadata(scratch_metadata) # So the copied foreign keys resolve
+            new_table = table.to_metadata(scratch_metadata, name=f'{table_name}_paise')
+            for index in table.indexes:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}_paise"))
+            new_table.create(connection)
+            # Columns added by later migrations don't exist yet; they take their server defaults
+            copied_columns = [column.name for column in table.columns if column.name in column_types]
+            select_list = ', '.join(
+                f"CAST(ROUND({name} * 100) AS INTEGER)" if name in money_columns else name
+                for name in copied_columns)
+            column_list = ', '.join(copied_columns)
+            connection.execute(text(f"INSERT INTO {table_name}_paise ({column_list}) SELECT {select_list} FROM {quoted_table}"))
+            connection.execute(text(f"DROP TABLE {quoted_table}"))
+            connection.execute(text(f"ALTER TABLE {table_name}_paise RENAME TO {quoted_table}"))
+        else:
+            for name in money_columns:
+                connection.execute(text(
+                    f"ALTER TABLE {quoted_table} ALTER COLUMN {name} TYPE BIGINT USING CAST(ROUND({name} * 100) AS BIGINT)"))
+
+def seed_account_number_sequence(connection):
+    counters = BankCounter.__table__
+    exists = connection.execute(select(counters.c.name).where(counters.c.name == 'account_number_sequence')).first()
+    if not exists:
+        connection.execute(counters.insert().values(name='account_number_sequence', value=0))
+
+# Full-text indexes: FTS5 tables that read their text from the source table, kept in sync by triggers
+SEARCH_INDEXES = {
+    'customer_search': ('customer', ('name', 'contact_info')),
+    'transaction_search': ('transaction', ('description',)),
+}
+
+def create_search_indexes(connection):
+    if connection.dialect.name != 'sqlite':
+        return # Search falls back to LIKE scans elsewhere
+    for index_name, (table_name, columns) in SEARCH_INDEXES.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'new.{column}' for column in columns)
+        old_values = ', '.join(f'old.{column}' for column in columns)
+        # prefix='2 3' keeps short prefix queries ("ra*", "ram*") from scanning the whole term list
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index_name} USING fts5({column_list}, "
+            f"content='{table_name}', content_rowid='id', prefix='2 3')"))
+        connection.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {index_name}_insert AFTER INSERT ON "{table_name}" BEGIN '
+            f'INSERT INTO {index_name}(rowid, {column_list}) VALUES (new.id, {new_values}); END'))
+        connection.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {index_name}_delete AFTER DELETE ON "{table_name}" BEGIN '
+            f"INSERT INTO {index_name}({index_name}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); END"))
+        connection.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {index_name}_update AFTER UPDATE OF {column_list} ON "{table_name}" BEGIN '
+            f"INSERT INTO {index_name}({index_name}, rowid, {column_list}) VALUES ('delete', old.id, {old_values}); "
+            f'INSERT INTO {index_name}(rowid, {column_list}) VALUES (new.id, {new_values}); END'))
+        connection.execute(text(f"INSERT INTO {index_name}({index_name}) VALUES ('rebuild')"))
+
+def add_balance_after(connection):
+    add_missing_columns('transaction', 'balance_after')(connection)
+    # Work back from each account's current balance: a posting's balance_after is the
+    # balance minus everything posted after it.
+    connection.execute(text("""
+        WITH later AS (
+            SELECT t.id,
+                   a.balance - COALESCE(SUM(CASE WHEN t.transaction_type IN :credit_types THEN t.amount ELSE -t.amount END)
+                       OVER (PARTITION BY t.account_id ORDER BY t.date DESC, t.id DESC
+                             ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS balance_after
+            FROM "transaction" t JOIN account a ON a.id = t.account_id
+        )
+        UPDATE "transaction" SET balance_after = later.balance_after
+        FROM later WHERE later.id = "transaction".id AND "transaction".balance_after IS NULL
+    """).bindparams(bindparam('credit_types', value=list(CREDIT_TRANSACTION_TYPES), expanding=True)))
+
+def make_account_ids_autoincrement(connection):
+    """Rebuilds a SQLite account table without AUTOINCREMENT, which hands the highest id
+    out again once that account is deleted."""
+    if connection.dialect.name != 'sqlite':
+        return
+    table_sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'account'")).scalar()
+    if 'AUTOINCREMENT' in table_sql.upper():
+        return
+    table = Account.__table__
+    scratch_metadata = db.MetaData()
+    for other_table in db.metadata.sorted_tables:
+        other_table.to_metadata(scratch_metadata) # So the copied foreign keys resolve
+    new_table = table.to_metadata(scratch_metadata, name='account_autoincrement')
+    for index in table.indexes:
+        connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    connection.execute(text("DROP TABLE IF EXISTS account_autoincrement"))
+    new_table.create(connection)
+    column_list = ', '.join(column.name for column in table.columns)
+    connection.execute(text(f"INSERT INTO account_autoincrement ({column_list}) SELECT {column_list} FROM account"))
+    connection.execute(text("DROP TABLE account"))
+    connection.execute(text("ALTER TABLE account_autoincrement RENAME TO account"))
+
+MIGRATIONS = [
+    (1, 'Add indexes for transaction, loan and account lookups', create_missing_indexes),
+    (2, 'Populate dashboard counters', rebuild_counters),
+    (3, 'Store money as integer paise', convert_money_to_paise),
+    (4, 'Track paid installments on loans', add_missing_columns('loan', 'installments_paid')),
+    (5, 'Start the account number sequence', seed_account_number_sequence),
+    (6, 'Add full-text search indexes', create_search_indexes),
+    (7, 'Record the balance after each posting', add_balance_after),
+    (8, 'Never reuse account ids', make_account_ids_autoincrement),
+]
+
+@contextmanager
+def schema_transaction():
+    """A connection in a transaction that holds the SQLite write lock from the start.
+
+    pysqlite doesn't emit BEGIN before DDL, so without an explicit one a table rebuild's
+    DROP INDEX and CREATE TABLE would each commit on their own. IMMEDIATE also makes
+    processes starting up at the same time take turns instead of racing each other.
+    """
+    with db.engine.begin() as connection:
+        if connection.dialect.name == 'sqlite':
+            connection.exec_driver_sql('BEGIN IMMEDIATE')
+        yield connection
+
+def create_schema():
+    """Creates missing tables, then applies pending migrations. Safe to run from several processes at once."""
+    with schema_transaction() as connection:
+        db.metadata.create_all(connection) # Not the replica bind, if any: it is a copy of the primary
+    apply_migrations()
+
+def apply_migrations():
+    applied_versions = {version for (version,) in db.session.query(SchemaMigration.version)}
+    db.session.commit()
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        try:
+            with schema_transaction() as connection:
+                # Another process may have applied it since we looked
+                if connection.execute(select(SchemaMigration.version).where(SchemaMigration.version == version)).first():
+                    continue
+                migrate(connection)
+                connection.execute(SchemaMigration.__table__.insert().values(
+                    version=version, name=name, applied_at=datetime.utcnow()))
+        except IntegrityError as e:
+            if 'schema_migration' not in str(e.orig):
+                raise
+            continue # Recorded by another process first
+        print(f"Applied migration {version}: {name}")
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Apply any pending schema migrations to the configured database."""
+    apply_migrations()
+    for migration in SchemaMigration.query.order_by(SchemaMigration.version):
+        print(f"{migration.version}: {migration.name} (applied {migration.applied_at:%Y-%m-%d %H:%M})")
+
 # --- Helper function to require admin login ---
 def admin_login_required(view_func):
     @wraps(view_func)
@@ -112,6 +742,1486 @@ def customer_login_required(view_func):
     return decorated_function
 
 
+# --- Posting Engine ---
+# Balances are never read into Python, changed and written back: two requests doing that
+# at the same time lose one of the updates. Each change is a single UPDATE evaluated by
+# the database, and debits only apply while the balance covers them. The caller adds any
+# other changes and commits (or rolls back) the whole posting as one transaction.
+
+CREDIT_TRANSACTION_TYPES = ('Deposit', 'Transfer (Credit)', 'Loan Disbursement')
+DEBIT_TRANSACTION_TYPES = ('Withdrawal', 'Transfer (Debit)', 'Loan Repayment')
+
+class InsufficientFundsError(Exception):
+    pass
+
+class AccountNotFoundError(Exception):
+    pass
+
+def signed_amount(transaction=Transaction):
+    """SQL expression for a posting's effect on its account: credits add, debits subtract."""
+    return case((transaction.transaction_type.in_(CREDIT_TRANSACTION_TYPES), transaction.amount), else_=-transaction.amount)
+
+# Both return the new balance, read back by the UPDATE itself (RETURNING), so it is
+# exactly the balance this posting produced even with other postings running.
+
+def credit_balance(account_id, amount, account_number=None, customer_id=None):
+    """Pass the account number and owner when the id came from a cache (AccountRef):
+    the UPDATE then only matches if the id still belongs to that account, so a stale
+    reference can never credit somebody else."""
+    conditions = [Account.id == account_id]
+    if account_number is not None:
+        conditions.append(Account.account_number == account_number)
+    if customer_id is not None:
+        conditions.append(Account.customer_id == customer_id)
+    balance = db.session.execute(
+        update(Account).where(*conditions)
+        .values(balance=Account.balance + amount)
+        .returning(Account.balance)
+        .execution_options(synchronize_session=False)).scalar_one_or_none()
+    if balance is None:
+        raise AccountNotFoundError(f"Account {account_id} does not exist")
+    return balance
+
+def debit_balance(account_id, amount):
+    balance = db.session.execute(
+        update(Account).where(Account.id == account_id, Account.balance >= amount)
+        .values(balance=Account.balance - amount)
+        .returning(Account.balance)
+        .execution_options(synchronize_session=False)).scalar_one_or_none()
+    if balance is None:
+        raise InsufficientFundsError(f"Account {account_id} cannot cover {amount}")
+    return balance
+
+def post_credit(account, amount, transaction_type, description):
+    balance = credit_balance(account.id, amount)
+    mark_customer_changed(account.customer_id)
+    transaction = Transaction(account_id=account.id, transaction_type=transaction_type, amount=amount, description=description, balance_after=balance)
+    db.session.add(transaction)
+    record_posting_event(transaction)
+    return transaction
+
+def post_debit(account, amount, transaction_type, description):
+    balance = debit_balance(account.id, amount)
+    mark_customer_changed(account.customer_id)
+    transaction = Transaction(account_id=account.id, transaction_type=transaction_type, amount=amount, description=description, balance_after=balance)
+    db.session.add(transaction)
+    record_posting_event(transaction)
+    return transaction
+
+def post_transfer(source_account, target_account, amount, description=None):
+    # Touch both rows in ascending id order, so two opposite transfers running at the
+    # same time take their row locks in the same order and cannot deadlock.
+    for account_id in sorted((source_account.id, target_account.id)):
+        if account_id == source_account.id:
+            source_balance = debit_balance(source_account.id, amount)
+        else:
+            target_balance = credit_balance(target_account.id, amount, target_account.account_number, target_account.customer_id)
+    mark_customer_changed(source_account.customer_id, target_account.customer_id)
+
+    debit_transaction = Transaction(
+        account_id=source_account.id,
+        transaction_type='Transfer (Debit)',
+        amount=amount,
+        description=f'Transfer to Account {target_account.account_number}' + (f': {description}' if description else ''),
+        target_account_id=target_account.id,
+        balance_after=source_balance
+    )
+    credit_transaction = Transaction(
+        account_id=target_account.id,
+        transaction_type='Transfer (Credit)',
+        amount=amount,
+        description=f'Transfer from Account {source_account.account_number}' + (f': {description}' if description else ''),
+        target_account_id=source_account.id,
+        balance_after=target_balance
+    )
+    db.session.add(debit_transaction)
+    db.session.add(credit_transaction)
+    record_posting_event(debit_transaction)
+    record_posting_event(credit_transaction)
+    return debit_transaction, credit_transaction
+
+
+# --- Transactional Outbox ---
+# Every posting adds an OutboxEvent to the same session, so the event commits or rolls
+# back with the posting and requests never wait for delivery. A dispatcher thread in each
+# server process claims a batch of undelivered events with a lease, hands it to every
+# configured sink and only then marks it dispatched. If a sink fails or the process dies
+# in between, the batch is delivered again once the lease runs out: delivery is
+# at-least-once, so consumers should skip event ids they have already seen.
+
+def posting_payload(transaction_type, account_id, amount, balance_after, description, target_account_id):
+    return json.dumps({'transaction_type': transaction_type, 'account_id': account_id, 'amount': amount,
+                       'balance_after': balance_after, 'description': description,
+                       'target_account_id': target_account_id, 'occurred_at': datetime.utcnow().isoformat()})
+
+def record_posting_event(transaction):
+    db.session.add(OutboxEvent(event_type='posting', transaction=transaction, payload=posting_payload(
+        transaction.transaction_type, transaction.account_id, transaction.amount, transaction.balance_after,
+        transaction.description, transaction.target_account_id)))
+    db.session.info['outbox_events_added'] = True
+
+def record_posting_events(transactions):
+    """Bulk version for postings inserted with core statements: (transaction id, row) pairs."""
+    rows = [{'event_type': 'posting', 'transaction_id': transaction_id, 'created_at': datetime.utcnow(), 'attempts': 0,
+             'payload': posting_payload(row['transaction_type'], row['account_id'], row['amount'], row.get('balance_after'),
+                                        row['description'], row['target_account_id'])}
+            for transaction_id, row in transactions]
+    if rows:
+        db.session.execute(OutboxEvent.__table__.insert(), rows)
+        db.session.info['outbox_events_added'] = True
+
+class FileSink:
+    """Appends events as JSON lines to a local file. It grows until something else rotates it."""
+    def __init__(self, path):
+        self.path = path
+
+    def deliver(self, events):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a') as f:
+            for outbox_event in events:
+                f.write(json.dumps(outbox_event) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+class QueueSink:
+    """Puts each batch on an in-process queue; a full queue fails the delivery so it is retried."""
+    def __init__(self, event_queue):
+        self.event_queue = event_queue
+
+    def deliver(self, events):
+        self.event_queue.put_nowait(events)
+
+class WebhookSink:
+    """POSTs each batch as {"events": [...]}; any error or non-2xx answer fails the delivery."""
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, events):
+        request_body = json.dumps({'events': events}).encode('utf-8')
+        outgoing = urllib.request.Request(self.url, data=request_body, headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(outgoing, timeout=self.timeout):
+            pass
+
+outbox_queue = queue.Queue(maxsize=1000)
+
+# Sink name (as used in OUTBOX_SINKS) -> factory; add entries here to plug in other sinks
+OUTBOX_SINK_FACTORIES = {
+    'file': lambda: FileSink(app.config['OUTBOX_FILE_PATH']),
+    'queue': lambda: QueueSink(outbox_queue),
+    'webhook': lambda: WebhookSink(app.config['OUTBOX_WEBHOOK_URL']),
+}
+
+def configured_outbox_sinks():
+    return [OUTBOX_SINK_FACTORIES[name.strip()]() for name in app.config['OUTBOX_SINKS'].split(',') if name.strip()]
+
+def dispatch_outbox_batch(sinks, batch_size, lease_seconds):
+    """Claims, delivers and marks one batch. Returns the number delivered, or None if delivery failed."""
+    now = datetime.utcnow()
+    token = secrets.token_hex(16)
+    claimable = and_(OutboxEvent.dispatched_at.is_(None),
+                     or_(OutboxEvent.claimed_until.is_(None), OutboxEvent.claimed_until < now))
+    candidates = select(OutboxEvent.id).where(claimable).order_by(OutboxEvent.id).limit(batch_size).scalar_subquery()
+    # The conditions are checked again by the UPDATE, so two dispatchers never claim the same event
+    db.session.execute(update(OutboxEvent).where(OutboxEvent.id.in_(candidates), claimable)
+                       .values(claimed_until=now + timedelta(seconds=lease_seconds), claim_token=token, attempts=OutboxEvent.attempts + 1)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    rows = (db.session.query(OutboxEvent.id, OutboxEvent.event_type, OutboxEvent.transaction_id, OutboxEvent.created_at, OutboxEvent.payload)
+            .filter(OutboxEvent.claim_token == token).order_by(OutboxEvent.id).all())
+    db.session.rollback()
+    if not rows:
+        return 0
+    events = [dict(json.loads(payload), id=event_id, type=event_type, transaction_id=transaction_id, created_at=created_at.isoformat())
+              for event_id, event_type, transaction_id, created_at, payload in rows]
+
+    try:
+        for sink in sinks:
+            sink.deliver(events)
+    except Exception as e:
+        print(f"Outbox delivery of {len(events)} event(s) failed, retrying after the lease: {e}")
+        db.session.execute(update(OutboxEvent).where(OutboxEvent.claim_token == token)
+                           .values(last_error=str(e)[:500]).execution_options(synchronize_session=False))
+        db.session.commit()
+        return None
+
+    db.session.execute(update(OutboxEvent).where(OutboxEvent.claim_token == token)
+                       .values(dispatched_at=datetime.utcnow(), claimed_until=None, last_error=None)
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    return len(events)
+
+def purge_dispatched_outbox_events():
+    cutoff = datetime.utcnow() - timedelta(days=app.config['OUTBOX_RETENTION_DAYS'])
+    db.session.execute(delete(OutboxEvent).where(OutboxEvent.dispatched_at < cutoff).execution_options(synchronize_session=False))
+    db.session.commit()
+
+class OutboxDispatcher:
+    """Background thread draining the outbox; woken by commits that added events, else polls."""
+    PURGE_INTERVAL = 3600
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pid = None
+
+    def ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            # Started per process: a forked server worker doesn't inherit the parent's thread
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name='outbox-dispatcher', daemon=True).start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self, stop_when_idle=False):
+        sinks = configured_outbox_sinks()
+        batch_size = app.config['OUTBOX_BATCH_SIZE']
+        last_purge = 0
+        while True:
+            self.wakeup.clear()
+            try:
+                with app.app_context():
+                    delivered = dispatch_outbox_batch(sinks, batch_size, app.config['OUTBOX_LEASE_SECONDS'])
+                    if time.monotonic() - last_purge > self.PURGE_INTERVAL:
+                        purge_dispatched_outbox_events()
+                        last_purge = time.monotonic()
+            except Exception as e:
+                print(f"Outbox dispatcher error: {e}")
+                delivered = None
+            if delivered is not None and delivered == batch_size:
+                continue # More may be waiting
+            if stop_when_idle and delivered == 0:
+                return
+            self.wakeup.wait(app.config['OUTBOX_POLL_SECONDS'])
+
+outbox_dispatcher = OutboxDispatcher()
+
+@app.before_request
+def start_outbox_dispatcher():
+    if app.config['OUTBOX_DISPATCHER'] == 'thread':
+        outbox_dispatcher.ensure_started()
+
+@event.listens_for(SQLAlchemySession, 'after_commit')
+def wake_outbox_dispatcher(db_session):
+    if db_session.info.pop('outbox_events_added', False):
+        outbox_dispatcher.notify()
+
+@event.listens_for(SQLAlchemySession, 'after_rollback')
+def forget_outbox_events(db_session):
+    db_session.info.pop('outbox_events_added', None)
+
+@app.cli.command('dispatch-outbox')
+@click.option('--once', is_flag=True, help='Exit once the outbox is empty instead of waiting for more events.')
+def dispatch_outbox_command(once):
+    """Deliver outbox events in the foreground, for deployments with OUTBOX_DISPATCHER=off."""
+    outbox_dispatcher.run(stop_when_idle=once)
+
+
+# --- Velocity Limits ---
+# Withdrawals and transfers are checked against sliding windows kept in memory: per
+# account and per customer (count and amount), plus caps on payments to payees the
+# customer has never paid before. A check is a few deque operations under a lock
+# instead of an aggregate query over Transaction. Every VELOCITY_SYNC_SECONDS a
+# background thread inserts the debits this process counted into velocity_event and
+# merges in the ones other processes inserted since the last sync, so the limits hold
+# across workers (give or take one sync interval) and survive a restart.
+
+class VelocityLimitError(Exception):
+    pass
+
+class VelocityLimiter:
+    KNOWN_PAYEES_CACHE_SIZE = 10000
+    KNOWN_PAYEES_TTL_SECONDS = 300 # Catches payees first paid without a velocity check, e.g. by batch postings
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.windows = {} # key -> deque of [unix time, amount], oldest first
+        self.unsaved = [] # (key, entry) counted here but not yet in velocity_event
+        self.retracted = [] # (key, entry) saved already, then uncounted
+        self.known_payees = OrderedDict() # customer id -> (loaded at, set of account ids paid before) (LRU)
+        self.last_seen_id = None # Highest velocity_event id merged; None until loaded
+        self.origin = None
+        self.sync_pid = None
+
+    def merge(self, rows):
+        """Adds (id, key, occurred_at, amount) rows from other processes; call with the lock held."""
+        for event_id, key, occurred_at, amount in rows:
+            bisect.insort(self.windows.setdefault(key, deque()), [occurred_at, amount])
+            self.last_seen_id = max(self.last_seen_id or 0, event_id)
+
+    def load(self):
+        """Reads the events still inside the window, once per process."""
+        cutoff = time.time() - app.config['VELOCITY_WINDOW_SECONDS']
+        rows = db.session.query(VelocityEvent.id, VelocityEvent.key, VelocityEvent.occurred_at, VelocityEvent.amount) \
+            .filter(VelocityEvent.occurred_at > cutoff).all()
+        max_id = db.session.query(func.max(VelocityEvent.id)).scalar() or 0
+        db.session.rollback()
+        with self.lock:
+            if self.last_seen_id is not None:
+                return
+            self.merge(rows)
+            self.last_seen_id = max_id
+
+    def payees_of(self, customer_id):
+        with self.lock:
+            cached = self.known_payees.get(customer_id)
+            if cached is not None and time.monotonic() - cached[0] < self.KNOWN_PAYEES_TTL_SECONDS:
+                self.known_payees.move_to_end(customer_id)
+                return cached[1]
+        loaded_at = time.monotonic()
+        payees = {account_id for (account_id,) in db.session.query(Transaction.target_account_id).distinct()
+                  .join(Account, Transaction.account_id == Account.id)
+                  .filter(Account.customer_id == customer_id, Transaction.transaction_type == 'Transfer (Debit)')}
+        with self.lock:
+            cached = self.known_payees.get(customer_id)
+            if cached is None or cached[0] < loaded_at:
+                self.known_payees[customer_id] = cached = (loaded_at, payees)
+            self.known_payees.move_to_end(customer_id)
+            if len(self.known_payees) > self.KNOWN_PAYEES_CACHE_SIZE:
+                self.known_payees.popitem(last=False)
+            return cached[1]
+
+    def window(self, key, cutoff):
+        events = self.windows.setdefault(key, deque())
+        while events and events[0][0] <= cutoff:
+            events.popleft()
+        return events
+
+    @contextmanager
+    def reserve(self, customer_id, account_id, amount, payee_account_id=None):
+        """Checks a debit against the limits and counts it; if the block raises, it is uncounted."""
+        if not app.config['VELOCITY_CHECKS']:
+            yield
+            return
+        self.ensure_sync_started()
+        if self.last_seen_id is None:
+            self.load()
+        config = app.config
+        payees = self.payees_of(customer_id) if payee_account_id is not None else None
+        window_minutes = config['VELOCITY_WINDOW_SECONDS'] // 60
+        now = time.time()
+        cutoff = now - config['VELOCITY_WINDOW_SECONDS']
+        entry = [now, amount]
+        with self.lock:
+            checks = [(f'account:{account_id}', 'this account', config['VELOCITY_ACCOUNT_MAX_COUNT'], config['VELOCITY_ACCOUNT_MAX_AMOUNT']),
+                      (f'customer:{customer_id}', 'your accounts', config['VELOCITY_CUSTOMER_MAX_COUNT'], config['VELOCITY_CUSTOMER_MAX_AMOUNT'])]
+            for key, label, max_count, max_amount in checks:
+                events = self.window(key, cutoff)
+                if len(events) + 1 > max_count:
+                    raise VelocityLimitError(f'Limit reached: at most {max_count} withdrawals and transfers from {label} in {window_minutes} minutes.')
+                if sum(event_amount for _, event_amount in events) + amount > max_amount * 100:
+                    raise VelocityLimitError(f'Limit reached: at most ₹{max_amount} in withdrawals and transfers from {label} in {window_minutes} minutes.')
+            new_payee = payees is not None and payee_account_id not in payees
+            if new_payee:
+                payee_key = f'payees:{customer_id}'
+                if amount > config['VELOCITY_NEW_PAYEE_MAX_AMOUNT'] * 100:
+                    raise VelocityLimitError(f"The first transfer to a new payee can be at most ₹{config['VELOCITY_NEW_PAYEE_MAX_AMOUNT']}.")
+                if len(self.window(payee_key, cutoff)) >= config['VELOCITY_NEW_PAYEES_PER_WINDOW']:
+                    raise VelocityLimitError(f"Limit reached: at most {config['VELOCITY_NEW_PAYEES_PER_WINDOW']} new payees in {window_minutes} minutes.")
+                checks.append((payee_key,))
+                payees.add(payee_account_id)
+            for key, *_ in checks:
+                self.windows[key].append(entry)
+                self.unsaved.append((key, entry))
+        try:
+            yield
+        except BaseException:
+            with self.lock:
+                for key, *_ in checks:
+                    events = self.windows.get(key)
+                    if events is not None and entry in events:
+                        events.remove(entry)
+                    if (key, entry) in self.unsaved:
+                        self.unsaved.remove((key, entry))
+                    else:
+                        self.retracted.append((key, entry))
+                if new_payee:
+                    payees.discard(payee_account_id)
+            raise
+
+    def sync(self):
+        """Saves the debits counted here and merges in those other processes saved."""
+        if self.last_seen_id is None:
+            self.load()
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, []
+            retracted, self.retracted = self.retracted, []
+            last_seen_id = self.last_seen_id
+        try:
+            if unsaved:
+                db.session.execute(VelocityEvent.__table__.insert(), [
+                    {'key': key, 'occurred_at': occurred_at, 'amount': amount, 'origin': self.origin}
+                    for key, (occurred_at, amount) in unsaved])
+            for key, (occurred_at, amount) in retracted:
+                db.session.execute(delete(VelocityEvent).where(
+                    VelocityEvent.key == key, VelocityEvent.occurred_at == occurred_at,
+                    VelocityEvent.amount == amount, VelocityEvent.origin == self.origin))
+            cutoff = time.time() - app.config['VELOCITY_WINDOW_SECONDS']
+            db.session.execute(delete(VelocityEvent).where(VelocityEvent.occurred_at <= cutoff))
+            rows = db.session.query(VelocityEvent.id, VelocityEvent.key, VelocityEvent.occurred_at, VelocityEvent.amount, VelocityEvent.origin) \
+                .filter(VelocityEvent.id > last_seen_id).order_by(VelocityEvent.id).all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                self.unsaved[:0] = unsaved
+                self.retracted[:0] = retracted
+            raise
+        with self.lock:
+            others = [(event_id, key, occurred_at, amount) for event_id, key, occurred_at, amount, origin in rows if origin != self.origin]
+            self.merge(others)
+            # A customer paid a new payee through another process: re-read their payees next time
+            for _, key, _, _ in others:
+                if key.startswith('payees:'):
+                    self.known_payees.pop(int(key.split(':', 1)[1]), None)
+            if rows:
+                self.last_seen_id = max(self.last_seen_id, rows[-1][0])
+
+    def ensure_sync_started(self):
+        if self.sync_pid == os.getpid():
+            return
+        with self.lock:
+            if self.sync_pid == os.getpid():
+                return
+            # A forked worker starts its own thread and counts as a different origin
+            self.sync_pid = os.getpid()
+            self.origin = secrets.token_hex(8)
+            threading.Thread(target=self.run_sync, name='velocity-sync', daemon=True).start()
+
+    def run_sync(self):
+        while True:
+            time.sleep(app.config['VELOCITY_SYNC_SECONDS'])
+            try:
+                with app.app_context():
+                    self.sync()
+            except Exception as e:
+                print(f"Error syncing velocity events: {e}")
+
+velocity_limiter = VelocityLimiter()
+
+
+# --- Idempotency Keys ---
+# Deposit, withdrawal and transfer POSTs may carry an Idempotency-Key header, or the
+# idempotency_key field the forms fill in when they are rendered, so a double-click or a
+# load balancer retry sends the same key. The key is stored with the posting in one
+# commit; a request whose key is already stored is answered from the stored result
+# without posting again. Keys are honoured for IDEMPOTENCY_KEY_TTL_HOURS; expired ones are
+# purged now and then after a posting commits, or with `flask purge-idempotency-keys`.
+
+class DuplicateRequestError(Exception):
+    """Another request with the same idempotency key committed first."""
+    def __init__(self, stored):
+        super().__init__('Duplicate request')
+        self.stored = stored
+
+def idempotency_key_from_request():
+    raw_key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not raw_key:
+        return None
+    return hashlib.sha256(raw_key.encode('utf-8')).hexdigest()
+
+def request_fingerprint(operation, *fields):
+    return hashlib.sha256(json.dumps([operation, *fields]).encode('utf-8')).hexdigest()
+
+def idempotency_key_cutoff():
+    return datetime.utcnow() - timedelta(hours=app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+
+def find_idempotency_key(customer_id, key):
+    if key is None:
+        return None
+    return IdempotencyKey.query.filter(IdempotencyKey.customer_id == customer_id, IdempotencyKey.key == key,
+                                       IdempotencyKey.created_at >= idempotency_key_cutoff()).first()
+
+def replay_idempotent_request(stored, fingerprint):
+    """The response for a request whose key was already used."""
+    if stored.fingerprint != fingerprint:
+        flash('This request was already submitted with different details. Please try again.', 'danger')
+    else:
+        flash(stored.result_message, 'success')
+    return redirect(url_for('customer_dashboard'))
+
+def commit_posting(customer_id, key, fingerprint, transaction, result_message):
+    """Commits the posting together with its idempotency key, if the request has one."""
+    if key is not None:
+        # An expired, not yet purged row with the same key would otherwise fail the insert
+        db.session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.customer_id == customer_id, IdempotencyKey.key == key,
+            IdempotencyKey.created_at < idempotency_key_cutoff()).execution_options(synchronize_session=False))
+        db.session.add(IdempotencyKey(customer_id=customer_id, key=key, fingerprint=fingerprint,
+                                      transaction=transaction, result_message=result_message))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        stored = find_idempotency_key(customer_id, key)
+        if stored is None:
+            raise
+        raise DuplicateRequestError(stored)
+    if key is not None and random.random() < 0.01: # Now and then, clear out expired keys
+        try:
+            purge_expired_idempotency_keys()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error purging idempotency keys: {e}")
+
+def purge_expired_idempotency_keys():
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < idempotency_key_cutoff())
+                                .execution_options(synchronize_session=False))
+    db.session.commit()
+    return result.rowcount
+
+@app.cli.command('purge-idempotency-keys')
+def purge_idempotency_keys_command():
+    """Delete idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS."""
+    print(f"Deleted {purge_expired_idempotency_keys()} expired idempotency key(s).")
+
+
+# --- Balance Snapshots ---
+
+def start_of_day(day):
+    return datetime(day.year, day.month, day.day)
+
+def take_balance_snapshots(as_of):
+    """Records every account's balance at as_of, skipping accounts that already have one.
+
+    Works back from the current balance, so only postings made since as_of are read.
+    Returns the number of snapshots written; the caller commits.
+    """
+    since_as_of = (select(func.coalesce(func.sum(signed_amount()), 0))
+                   .where(Transaction.account_id == Account.id, Transaction.date >= as_of)
+                   .scalar_subquery())
+    already_taken = select(BalanceSnapshot.id).where(BalanceSnapshot.account_id == Account.id, BalanceSnapshot.as_of == as_of).exists()
+    accounts = (select(Account.id, bindparam('as_of', as_of, type_=db.DateTime), Account.balance - since_as_of)
+                .where(Account.opening_date < as_of, ~already_taken))
+    result = db.session.execute(BalanceSnapshot.__table__.insert().from_select(['account_id', 'as_of', 'balance'], accounts))
+    return result.rowcount
+
+def balance_as_of(account, moment):
+    """The account's balance just before moment: the nearest earlier snapshot plus the postings after it."""
+    snapshot = (BalanceSnapshot.query.filter(BalanceSnapshot.account_id == account.id, BalanceSnapshot.as_of <= moment)
+                .order_by(BalanceSnapshot.as_of.desc()).first())
+    if snapshot is None:
+        # No snapshot yet: work back from the current balance instead
+        since = db.session.query(func.coalesce(func.sum(signed_amount()), 0)).filter(
+            Transaction.account_id == account.id, Transaction.date >= moment).scalar()
+        return account.balance - since
+    posted = db.session.query(func.coalesce(func.sum(signed_amount()), 0)).filter(
+        Transaction.account_id == account.id, Transaction.date >= snapshot.as_of, Transaction.date < moment).scalar()
+    return snapshot.balance + posted
+
+@app.cli.command('snapshot-balances')
+@click.option('--date', 'day', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Snapshot balances at the start of this day (default: today).')
+def snapshot_balances_command(day):
+    """Record every account's balance at the start of a day, e.g. nightly from cron."""
+    as_of = start_of_day(day or datetime.utcnow())
+    count = take_balance_snapshots(as_of)
+    db.session.commit()
+    print(f"Recorded {count} balance snapshot(s) as of {as_of:%Y-%m-%d %H:%M}.")
+
+
+# --- Ledger Reconciliation ---
+# Two checks, both as set-based SQL over a range of account ids:
+#   * each account's balance equals the signed sum of its postings
+#   * each 'Transfer (Debit)' has a 'Transfer (Credit)' for the same amount on its target
+#     account pointing back at it, and vice versa. Legs are matched by count per
+#     (source, target, amount), so each transfer pair is checked from its source account.
+# Deleting a customer deletes their legs and clears target_account_id on the legs that
+# survive on the other side. Those are expected, so they are counted separately (per
+# surviving account, in both directions) instead of being reported as orphans.
+# The account ids are split into ranges checked in parallel by a process pool.
+
+RECONCILIATION_PARTITIONS_PER_WORKER = 4
+
+def find_balance_mismatches(connection, account_condition):
+    ledger = (select(Transaction.account_id, func.sum(signed_amount()).label('ledger_balance'))
+              .where(account_condition(Transaction.account_id))
+              .group_by(Transaction.account_id)
+              .subquery())
+    ledger_balance = func.coalesce(ledger.c.ledger_balance, 0)
+    rows = connection.execute(
+        select(Account.id, Account.account_number, Account.balance, ledger_balance)
+        .outerjoin(ledger, ledger.c.account_id == Account.id)
+        .where(account_condition(Account.id), Account.balance != ledger_balance))
+    return [{'account_id': account_id, 'account_number': account_number, 'balance': balance, 'ledger_balance': ledger_balance}
+            for account_id, account_number, balance, ledger_balance in rows]
+
+def find_orphaned_transfer_legs(connection, account_condition):
+    debits = (select(Transaction.account_id.label('source_id'), Transaction.target_account_id.label('target_id'),
+                     Transaction.amount.label('amount'), func.count().label('legs'))
+              .where(Transaction.transaction_type == 'Transfer (Debit)', account_condition(Transaction.account_id),
+                     Transaction.target_account_id.isnot(None))
+              .group_by(Transaction.account_id, Transaction.target_account_id, Transaction.amount))
+    credits = (select(Transaction.target_account_id.label('source_id'), Transaction.account_id.label('target_id'),
+                      Transaction.amount.label('amount'), -func.count().label('legs'))
+               .where(Transaction.transaction_type == 'Transfer (Credit)', account_condition(Transaction.target_account_id),
+                      Transaction.target_account_id.isnot(None))
+               .group_by(Transaction.target_account_id, Transaction.account_id, Transaction.amount))
+    legs = debits.union_all(credits).subquery()
+    rows = connection.execute(
+        select(legs.c.source_id, legs.c.target_id, legs.c.amount, func.sum(legs.c.legs))
+        .group_by(legs.c.source_id, legs.c.target_id, legs.c.amount)
+        .having(func.sum(legs.c.legs) != 0))
+    # A positive difference is debits without their credit, a negative one credits without their debit
+    return [{'source_account_id': source_id, 'target_account_id': target_id, 'amount': amount,
+             'unmatched': abs(difference), 'missing_leg': 'Transfer (Credit)' if difference > 0 else 'Transfer (Debit)'}
+            for source_id, target_id, amount, difference in rows]
+
+def count_deleted_counterparty_legs(connection, account_condition):
+    """Transfer legs whose other side was deleted along with its customer: {transaction type: legs}."""
+    rows = connection.execute(
+        select(Transaction.transaction_type, func.count())
+        .where(Transaction.transaction_type.in_(('Transfer (Debit)', 'Transfer (Credit)')),
+               Transaction.target_account_id.is_(None), account_condition(Transaction.account_id))
+        .group_by(Transaction.transaction_type))
+    return dict(rows.all())
+
+reconciliation_engine = None
+
+def reconcile_partition(database_uri, first_id, last_id):
+    """Runs in a pool process: checks the accounts with first_id <= id <= last_id."""
+    global reconciliation_engine
+    if reconciliation_engine is None:
+        reconciliation_engine = create_engine(database_uri)
+    in_range = lambda column: column.between(first_id, last_id)
+    with reconciliation_engine.connect() as connection:
+        return (find_balance_mismatches(connection, in_range), find_orphaned_transfer_legs(connection, in_range),
+                count_deleted_counterparty_legs(connection, in_range))
+
+def reconcile_ledger(workers, partitions):
+    """Returns (balance mismatches, orphaned transfer legs, legs with a deleted counterparty)
+    for the whole ledger."""
+    first_id, last_id = db.session.query(func.min(Account.id), func.max(Account.id)).one()
+    transfer_ids = db.session.query(func.min(Transaction.account_id), func.max(Transaction.account_id),
+                                    func.min(Transaction.target_account_id), func.max(Transaction.target_account_id)).one()
+    # Transfer legs can point at accounts that no longer exist, so cover their ids too
+    known_ids = [value for value in (first_id, last_id) + tuple(transfer_ids) if value is not None]
+    if not known_ids:
+        return [], [], {}
+    first_id, last_id = min(known_ids), max(known_ids)
+
+    step = max(1, -(-(last_id - first_id + 1) // partitions))
+    ranges = [(start, min(start + step - 1, last_id)) for start in range(first_id, last_id + 1, step)]
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+    db.session.remove() # Don't hand an open connection to the forked workers
+
+    mismatches, orphaned_legs, deleted_counterparty_legs = [], [], {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for partition_mismatches, partition_orphans, partition_deleted in pool.map(
+                reconcile_partition, [database_uri] * len(ranges), *zip(*ranges)):
+            mismatches.extend(partition_mismatches)
+            orphaned_legs.extend(partition_orphans)
+            for transaction_type, legs in partition_deleted.items():
+                deleted_counterparty_legs[transaction_type] = deleted_counterparty_legs.get(transaction_type, 0) + legs
+
+    # Partitions are read at slightly different moments, so a posting made mid-run can look
+    # like a problem. Check whatever was flagged again, in one consistent read.
+    if mismatches:
+        flagged_ids = [mismatch['account_id'] for mismatch in mismatches]
+        mismatches = find_balance_mismatches(db.session.connection(), lambda column: column.in_(flagged_ids))
+    if orphaned_legs:
+        flagged_ids = [leg['source_account_id'] for leg in orphaned_legs]
+        orphaned_legs = find_orphaned_transfer_legs(db.session.connection(), lambda column: column.in_(flagged_ids))
+    db.session.rollback()
+    return mismatches, orphaned_legs, deleted_counterparty_legs
+
+@app.cli.command('reconcile-ledger')
+@click.option('--workers', default=os.cpu_count() or 2, show_default=True, help='Number of processes to check partitions in.')
+@click.option('--partitions', default=None, type=int, help=f'Number of account id ranges (default: {RECONCILIATION_PARTITIONS_PER_WORKER} per worker).')
+def reconcile_ledger_command(workers, partitions):
+    """Check every account balance against its postings and every transfer for both legs."""
+    started = time.perf_counter()
+    mismatches, orphaned_legs, deleted_counterparty_legs = reconcile_ledger(
+        workers, partitions or workers * RECONCILIATION_PARTITIONS_PER_WORKER)
+    elapsed = time.perf_counter() - started
+
+    for mismatch in mismatches:
+        print(f"Balance mismatch on account {mismatch['account_number']} (id {mismatch['account_id']}): "
+              f"balance {format_rupees(mismatch['balance'])}, postings add up to {format_rupees(mismatch['ledger_balance'])}")
+    for leg in orphaned_legs:
+        print(f"Orphaned transfer legs: {leg['unmatched']} x {format_rupees(leg['amount'])} from account id {leg['source_account_id']} "
+              f"to account id {leg['target_account_id']} without a matching '{leg['missing_leg']}'")
+    for transaction_type, legs in sorted(deleted_counterparty_legs.items()):
+        print(f"Expected: {legs} '{transaction_type}' leg(s) whose other account was deleted with its customer")
+    print(f"Reconciled in {elapsed:.2f}s with {workers} worker(s): "
+          f"{len(mismatches)} balance mismatch(es), {len(orphaned_legs)} orphaned transfer group(s).")
+    if mismatches or orphaned_legs:
+        raise SystemExit(1)
+
+
+# --- Loan Amortization ---
+# Equal monthly installments (EMI) on a reducing balance. Schedules are built in integer
+# paise, with the final installment absorbing rounding so the principal ends at exactly 0.
+# The portfolio summary doesn't build schedules at all: outstanding principal after k
+# installments has a closed form, so each loan costs O(1) whatever its term.
+
+MAX_INTEREST_RATE = 100 # Percent per year
+MAX_TERM_MONTHS = 600
+
+class InvalidLoanTermsError(ValueError):
+    pass
+
+def check_loan_terms(annual_rate, term_months):
+    if annual_rate is None or not math.isfinite(annual_rate) or not 0 <= annual_rate <= MAX_INTEREST_RATE:
+        raise InvalidLoanTermsError(f"Interest rate must be between 0 and {MAX_INTEREST_RATE}%, not {annual_rate!r}")
+    if term_months is None or not 1 <= term_months <= MAX_TERM_MONTHS:
+        raise InvalidLoanTermsError(f"Term must be between 1 and {MAX_TERM_MONTHS} months, not {term_months!r}")
+
+def installment_amount(principal, annual_rate, term_months):
+    check_loan_terms(annual_rate, term_months)
+    monthly_rate = annual_rate / 1200
+    if monthly_rate == 0:
+        return -(-principal // term_months) # Round up so term_months installments cover the principal
+    growth = (1 + monthly_rate) ** term_months
+    return round(principal * monthly_rate * growth / (growth - 1))
+
+def outstanding_principal(principal, annual_rate, term_months, installments_paid):
+    installments_paid = min(max(installments_paid, 0), term_months)
+    if installments_paid == term_months:
+        return 0
+    monthly_rate = annual_rate / 1200
+    installment = installment_amount(principal, annual_rate, term_months)
+    if monthly_rate == 0:
+        return max(principal - installment * installments_paid, 0)
+    growth = (1 + monthly_rate) ** installments_paid
+    return max(round(principal * growth - installment * (growth - 1) / monthly_rate), 0)
+
+def add_months(start, months):
+    month_index = start.month - 1 + months
+    year, month = start.year + month_index // 12, month_index % 12 + 1
+    return start.replace(year=year, month=month, day=min(start.day, calendar.monthrange(year, month)[1]))
+
+def installments_due_by(start, run_date, term_months):
+    """Installments whose due date, add_months(start, n), falls on or before run_date."""
+    due = min(max((run_date.year - start.year) * 12 + run_date.month - start.month, 0), term_months)
+    # Installment `due` falls in run_date's month, possibly later in it; the one before never does
+    if due and add_months(start, due).date() > run_date.date():
+        due -= 1
+    return due
+
+def amortization_schedule(loan):
+    """Returns one dict per installment: number, due_date, payment, principal, interest, balance."""
+    monthly_rate = loan.interest_rate / 1200
+    installment = installment_amount(loan.loan_amount, loan.interest_rate, loan.term_months)
+    start = loan.approval_date or loan.application_date
+    balance = loan.loan_amount
+    schedule = []
+    for number in range(1, loan.term_months + 1):
+        interest = round(balance * monthly_rate)
+        principal = balance if number == loan.term_months else min(installment - interest, balance)
+        balance -= principal
+        schedule.append({
+            'number': number,
+            'due_date': add_months(start, number),
+            'payment': principal + interest,
+            'principal': principal,
+            'interest': interest,
+            'balance': balance,
+        })
+    return schedule
+
+LOAN_EXPOSURE_BANDS = ((12, 'Up to 12 months left'), (36, '13 - 36 months left'), (None, 'More than 36 months left'))
+
+def loan_exposure_report():
+    bands = {label: {'band': label, 'loans': 0, 'outstanding': 0, 'monthly_collection': 0} for _, label in LOAN_EXPOSURE_BANDS}
+    totals = {'loans': 0, 'disbursed': 0, 'outstanding': 0, 'monthly_collection': 0}
+
+    # Plain tuples, streamed in batches, keep memory flat across the whole loan book
+    rows = db.session.query(Loan.loan_amount, Loan.interest_rate, Loan.term_months, Loan.installments_paid) \
+        .filter(Loan.status == 'Approved').execution_options(yield_per=10000)
+    for principal, annual_rate, term_months, paid in rows:
+        remaining = term_months - paid
+        try:
+            outstanding = outstanding_principal(principal, annual_rate, term_months, paid)
+            installment = installment_amount(principal, annual_rate, term_months) if remaining else 0
+        except InvalidLoanTermsError:
+            continue # Stored before the terms were validated; shows up on its loan page instead
+
+        label = next(label for limit, label in LOAN_EXPOSURE_BANDS if limit is None or remaining <= limit)
+        bands[label]['loans'] += 1
+        bands[label]['outstanding'] += outstanding
+        bands[label]['monthly_collection'] += installment
+        totals['loans'] += 1
+        totals['disbursed'] += principal
+        totals['outstanding'] += outstanding
+        totals['monthly_collection'] += installment
+
+    return {'totals': totals, 'bands': list(bands.values())}
+
+
+# --- Loan Repayments ---
+# A repayment run collects every installment that has fallen due on approved loans.
+# Loans are walked in id order, chunk by chunk, with one commit per chunk, so a run that
+# stops halfway can simply be started again. Installments already collected are skipped
+# (Loan.installments_paid, backed by the unique (loan_id, installment_number) key on
+# loan_repayment), so running twice for the same date never debits twice. An installment
+# the account can't cover is recorded as 'Missed' and retried on the next run.
+
+REPAYMENT_CHUNK_SIZE = 500
+
+def installment_payment(loan, number):
+    if number < loan.term_months:
+        return installment_amount(loan.loan_amount, loan.interest_rate, loan.term_months)
+    return amortization_schedule(loan)[-1]['payment'] # The last one absorbs rounding
+
+def collect_repayment_chunk(loans, run_date, stats):
+    now = datetime.utcnow()
+    missed = {
+        (repayment.loan_id, repayment.installment_number): repayment
+        for repayment in LoanRepayment.query.filter(
+            LoanRepayment.loan_id.in_([loan.id for loan in loans]), LoanRepayment.status == 'Missed')
+    }
+
+    for loan in loans:
+        installments_due = installments_due_by(loan.approval_date, run_date, loan.term_months)
+        for number in range(loan.installments_paid + 1, installments_due + 1):
+            try:
+                amount = installment_payment(loan, number)
+            except InvalidLoanTermsError as e:
+                print(f"Skipping loan #{loan.id}: {e}")
+                break
+            repayment = missed.get((loan.id, number))
+            if repayment is not None:
+                # A retry updates the existing row, which the unique key doesn't guard: claim
+                # it first, so a concurrent run that already moved it out of 'Missed' wins
+                claimed = db.session.execute(
+                    update(LoanRepayment).where(LoanRepayment.id == repayment.id, LoanRepayment.status == 'Missed')
+                    .values(status='Paid', attempted_at=now)).rowcount
+                if not claimed:
+                    break
+            try:
+                balance = debit_balance(loan.account_id, amount)
+                status = 'Paid'
+            except InsufficientFundsError:
+                status = 'Missed'
+
+            if repayment is None:
+                repayment = LoanRepayment(loan_id=loan.id, installment_number=number,
+                                          due_date=add_months(loan.approval_date, number), amount=amount)
+                db.session.add(repayment)
+            repayment.status = status
+            repayment.attempted_at = now
+            if status == 'Missed':
+                stats['missed'] += 1
+                break # Later installments wait until this one is collected
+
+            repayment.transaction = Transaction(
+                account_id=loan.account_id,
+                transaction_type='Loan Repayment',
+                amount=amount,
+                date=now,
+                description=f'Loan #{loan.id} installment {number}/{loan.term_months}',
+                balance_after=balance
+            )
+            db.session.add(repayment.transaction)
+            record_posting_event(repayment.transaction)
+            loan.installments_paid = number
+            mark_customer_changed(loan.customer_id)
+            stats['paid'] += 1
+            stats['collected'] += amount
+
+        if loan.installments_paid == loan.term_months:
+            loan.status = 'Closed'
+            stats['closed'] += 1
+
+def run_loan_repayments(run_date, chunk_size=REPAYMENT_CHUNK_SIZE):
+    stats = {'paid': 0, 'missed': 0, 'collected': 0, 'closed': 0, 'failed_chunks': 0}
+    last_loan_id = 0
+    while True:
+        loans = Loan.query.filter(Loan.status == 'Approved', Loan.approval_date.isnot(None), Loan.id > last_loan_id) \
+            .order_by(Loan.id).limit(chunk_size).all()
+        if not loans:
+            break
+        last_loan_id = loans[-1].id
+
+        try:
+            collect_repayment_chunk(loans, run_date, stats)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            stats['failed_chunks'] += 1
+            print(f"Error collecting repayments for loans {loans[0].id}-{last_loan_id}: {e}")
+        db.session.expunge_all() # Keep the identity map from growing across the whole loan book
+    return stats
+
+@app.cli.command('run-repayments')
+@click.option('--date', 'run_date', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Collect installments due on or before this date (default: today).')
+@click.option('--chunk-size', default=REPAYMENT_CHUNK_SIZE, show_default=True, help='Loans processed per commit.')
+def run_repayments_command(run_date, chunk_size):
+    """Collect due loan installments from the linked accounts. Safe to re-run."""
+    run_date = run_date or datetime.utcnow()
+    started = time.perf_counter()
+    stats = run_loan_repayments(run_date, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f"Repayments due by {run_date:%Y-%m-%d}: {stats['paid']} collected (₹{format_rupees(stats['collected'])}), "
+          f"{stats['missed']} missed for insufficient funds, {stats['closed']} loans closed, "
+          f"{stats['failed_chunks']} failed chunks, in {elapsed:.2f}s.")
+
+
+# --- Query Layer for Admin Listings ---
+# The templates walk relationships per row (customer.accounts, transaction.account, ...).
+# These helpers load the related rows in bulk so a page costs a fixed number of queries
+# instead of one extra SELECT per row.
+
+def customers_with_accounts_query():
+    return Customer.query.options(selectinload(Customer.accounts))
+
+def accounts_with_customer_query():
+    return Account.query.options(joinedload(Account.customer))
+
+def loans_with_customer_and_account_query():
+    return Loan.query.options(joinedload(Loan.customer), joinedload(Loan.account))
+
+def transactions_with_accounts_query():
+    return Transaction.query.options(joinedload(Transaction.account), joinedload(Transaction.target_account))
+
+def customer_with_accounts_and_loans_query():
+    return Customer.query.options(
+        selectinload(Customer.accounts),
+        selectinload(Customer.loans).joinedload(Loan.account)
+    )
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """Fails if more than max_queries SQL statements run inside the block.
+
+    Meant for tests and debugging, e.g.:
+
+        with app.app_context(), assert_max_queries(5):
+            client.get('/admin/customers')
+    """
+    statements = []
+
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    if len(statements) > max_queries:
+        raise AssertionError(f"Expected at most {max_queries} queries, got {len(statements)}:\n" + "\n".join(statements))
+
+
+# --- Server-Side Sessions and Customer Context ---
+# Sessions can be kept server-side, with the cookie only carrying a random session id that
+# is replaced on every login and logout. A store also caches a compact context per
+# customer (accounts with balances, loans), so the dashboard and loan pages render without
+# touching the database. Anything that changes a customer's accounts or loans calls
+# mark_customer_changed(); once that transaction commits, the customer's cached context is
+# dropped and its generation bumped, so a context built from an older read isn't cached.
+
+class MemoryStore:
+    """Least-recently-used key/value store with expiry, local to one process."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+class SQLiteStore:
+    """Key/value store with expiry in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.serializer = TaggedJSONSerializer()
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection().execute('CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, key):
+        row = self.connection().execute('SELECT value, expires_at FROM store WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return self.serializer.loads(row[0])
+
+    def set(self, key, value, ttl):
+        self.connection().execute('INSERT OR REPLACE INTO store (key, value, expires_at) VALUES (?, ?, ?)',
+                                  (key, self.serializer.dumps(value), time.time() + ttl))
+        if random.random() < 0.01: # Now and then, clear out expired entries
+            self.connection().execute('DELETE FROM store WHERE expires_at < ?', (time.time(),))
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM store WHERE key = ?', (key,))
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Moves the session to a fresh id; the old one is deleted when the session is saved."""
+        if self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(f'session:{sid}')
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32))
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.replaced_sid is not None:
+            self.store.delete(f'session:{session.replaced_sid}')
+
+        if not session:
+            if session.modified:
+                self.store.delete(f'session:{session.sid}')
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not self.should_set_cookie(app, session):
+            return
+        self.store.set(f'session:{session.sid}', dict(session), app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+stores = {}
+def make_store(kind):
+    """One store per kind, shared by sessions and customer context; None for 'cookie'/'off'."""
+    if kind not in ('sqlite', 'memory'):
+        return None
+    if kind not in stores:
+        stores[kind] = SQLiteStore(app.config['SESSION_STORE_PATH']) if kind == 'sqlite' else MemoryStore()
+    return stores[kind]
+
+session_store = make_store(app.config['SESSION_STORE'])
+if session_store is not None:
+    app.session_interface = ServerSideSessionInterface(session_store)
+context_store = make_store(app.config['CUSTOMER_CONTEXT_STORE'])
+
+def regenerate_session():
+    """Call on login and logout, so a session id planted before login is never authenticated.
+    Cookie sessions carry their data in the signed cookie and need nothing."""
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+def build_customer_context(customer_id):
+    customer = customer_with_accounts_and_loans_query().filter_by(id=customer_id).first()
+    if customer is None:
+        return None
+    return {
+        'id': customer.id,
+        'name': customer.name,
+        'accounts': [
+            {'id': account.id, 'account_number': account.account_number, 'account_type': account.account_type,
+             'balance': account.balance, 'opening_date': account.opening_date}
+            for account in customer.accounts
+        ],
+        'loans': [
+            {'id': loan.id, 'loan_amount': loan.loan_amount, 'interest_rate': loan.interest_rate,
+             'term_months': loan.term_months, 'status': loan.status, 'application_date': loan.application_date,
+             'monthly_installment': loan.monthly_installment,
+             'account': {'account_number': loan.account.account_number} if loan.account else None}
+            for loan in customer.loans
+        ],
+    }
+
+def load_customer_context(customer_id):
+    """Returns the cached context for a customer, or None if the customer no longer exists."""
+    if context_store is None:
+        return build_customer_context(customer_id)
+    key = f'customer-context:{customer_id}'
+    context = context_store.get(key)
+    if context is None:
+        generation_key = f'customer-context-generation:{customer_id}'
+        generation = context_store.get(generation_key)
+        context = build_customer_context(customer_id)
+        if context is not None:
+            context_store.set(key, context, app.config['CUSTOMER_CONTEXT_TTL'])
+            if context_store.get(generation_key) != generation:
+                # A change committed while we were reading, so this context may predate it
+                context_store.delete(key)
+    return context
+
+def mark_customer_changed(*customer_ids):
+    db.session.info.setdefault('changed_customer_ids', set()).update(customer_ids)
+
+@event.listens_for(SQLAlchemySession, 'after_commit')
+def drop_changed_customer_contexts(db_session):
+    changed_customer_ids = db_session.info.pop('changed_customer_ids', ())
+    if context_store is not None:
+        for customer_id in changed_customer_ids:
+            context_store.set(f'customer-context-generation:{customer_id}', secrets.token_hex(8),
+                              app.config['CUSTOMER_CONTEXT_TTL'] + 60)
+            context_store.delete(f'customer-context:{customer_id}')
+
+@event.listens_for(SQLAlchemySession, 'after_rollback')
+def forget_changed_customers(db_session):
+    db_session.info.pop('changed_customer_ids', None)
+
+
+# --- Account Numbers ---
+# New account numbers are 12 digits: '7', a 10-digit sequence number and a Luhn check
+# digit. Older accounts have random 10-digit numbers, so the two can never collide. Each
+# process reserves a block of sequence numbers with a single UPDATE and hands them out
+# without further queries. Numbers in an unused block are simply skipped.
+#
+# Transfers resolve target account numbers through a bounded LRU cache. Account numbers
+# never change, and credit_balance() matches the id together with the number and owner,
+# so a deleted account (even one whose id was handed out again) credits no row.
+
+ACCOUNT_NUMBER_BLOCK_SIZE = 100
+ACCOUNT_REF_CACHE_SIZE = 100000
+ACCOUNT_REF_CACHE_TTL = 24 * 60 * 60
+
+AccountRef = namedtuple('AccountRef', 'id account_number customer_id')
+
+def luhn_check_digit(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if position % 2 == 0 else 1)
+        total += value - 9 if value > 9 else value
+    return str((10 - total % 10) % 10)
+
+def format_account_number(sequence):
+    digits = f"7{sequence:010d}"
+    return digits + luhn_check_digit(digits)
+
+def reserve_account_number_block(size):
+    """Reserves size sequence numbers in their own transaction; returns (first, end)."""
+    counters = BankCounter.__table__
+    with db.engine.begin() as connection:
+        connection.execute(update(counters).where(counters.c.name == 'account_number_sequence')
+                           .values(value=counters.c.value + size))
+        end = connection.execute(select(counters.c.value).where(counters.c.name == 'account_number_sequence')).scalar()
+    return end - size + 1, end + 1
+
+class AccountNumberAllocator:
+    def __init__(self, block_size=ACCOUNT_NUMBER_BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_sequence = self.end_sequence = 0
+        self.pid = os.getpid()
+
+    def allocate(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # Forked worker: the parent's block is not ours to use
+                self.next_sequence = self.end_sequence = 0
+                self.pid = os.getpid()
+            if self.next_sequence >= self.end_sequence:
+                self.next_sequence, self.end_sequence = reserve_account_number_block(self.block_size)
+            sequence = self.next_sequence
+            self.next_sequence += 1
+        return format_account_number(sequence)
+
+account_number_allocator = AccountNumberAllocator()
+account_ref_cache = MemoryStore(max_entries=ACCOUNT_REF_CACHE_SIZE)
+
+def resolve_account_number(account_number):
+    """Returns an AccountRef for an account number, or None if there is no such account."""
+    account_ref = account_ref_cache.get(account_number)
+    if account_ref is None:
+        row = db.session.query(Account.id, Account.account_number, Account.customer_id) \
+            .filter(Account.account_number == account_number).first()
+        if row is None:
+            return None
+        account_ref = AccountRef(*row)
+        account_ref_cache.set(account_number, account_ref, ACCOUNT_REF_CACHE_TTL)
+    return account_ref
+
+
+# --- Read Replica ---
+# In snapshot mode, a stale snapshot is refreshed on a background thread while requests
+# keep reading the previous one. A file lock next to the snapshot makes sure only one
+# process on the host copies the database at a time; `flask snapshot-replica` from cron
+# takes the same lock, so requests then never have to trigger a refresh at all.
+replica_snapshot_lock = threading.Lock() # Held while this process runs a background refresh
+
+def take_replica_snapshot():
+    """Copies the primary SQLite database to REPLICA_SNAPSHOT_PATH with the online backup API."""
+    snapshot_path = app.config['REPLICA_SNAPSHOT_PATH']
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    partial_path = f'{snapshot_path}.{os.getpid()}.partial'
+    source = sqlite3.connect(db.engine.url.database)
+    destination = sqlite3.connect(partial_path)
+    try:
+        source.backup(destination)
+        destination.execute('PRAGMA journal_mode=DELETE') # A WAL snapshot would need its -wal file moved along with it
+    finally:
+        destination.close()
+        source.close()
+    # Readers opening the snapshot see either the old file or the new one, never a half-written copy
+    os.replace(partial_path, snapshot_path)
+
+def replica_snapshot_taken_at():
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(app.config['REPLICA_SNAPSHOT_PATH']))
+    except FileNotFoundError:
+        return None
+
+def replica_snapshot_is_stale(taken_at):
+    return taken_at is None or (datetime.now() - taken_at).total_seconds() >= app.config['REPLICA_MAX_STALENESS']
+
+@contextmanager
+def replica_snapshot_file_lock(blocking=True):
+    """Yields whether this process holds the host-wide snapshot lock."""
+    if fcntl is None:
+        yield True
+        return
+    lock_path = f"{app.config['REPLICA_SNAPSHOT_PATH']}.lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False # Another process is taking a snapshot right now
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def refresh_replica_snapshot():
+    with replica_snapshot_file_lock(blocking=False) as locked:
+        # Checked again under the lock: another process may have just finished one
+        if locked and replica_snapshot_is_stale(replica_snapshot_taken_at()):
+            take_replica_snapshot()
+
+def start_replica_snapshot_refresh():
+    """Refreshes the snapshot on a background thread, unless this process is already doing so."""
+    if not replica_snapshot_lock.acquire(blocking=False):
+        return
+    def run():
+        try:
+            with app.app_context():
+                refresh_replica_snapshot()
+        except Exception as e:
+            print(f"Error refreshing replica snapshot: {e}")
+        finally:
+            replica_snapshot_lock.release()
+    threading.Thread(target=run, name='replica-snapshot', daemon=True).start()
+
+def replica_reads(view_func):
+    """Runs a read-only view against the replica and tells the template how stale that data may be."""
+    @wraps(view_func)
+    def decorated_function(*args, **kwargs):
+        mode = app.config['REPLICA_MODE']
+        g.read_from_replica = mode != 'off'
+        if mode == 'snapshot':
+            taken_at = replica_snapshot_taken_at()
+            if replica_snapshot_is_stale(taken_at):
+                start_replica_snapshot_refresh()
+            if taken_at is None:
+                # Nothing to read yet: use the primary rather than wait for the first copy
+                g.read_from_replica = False
+            else:
+                age = int((datetime.now() - taken_at).total_seconds())
+                g.replica_notice = f"Showing a snapshot taken at {taken_at.strftime('%Y-%m-%d %H:%M:%S')} ({age}s ago); later activity is not included."
+        elif mode == 'bind':
+            g.replica_notice = f"Showing data from the read replica, which may be up to {app.config['REPLICA_MAX_STALENESS']}s behind."
+        return view_func(*args, **kwargs)
+    return decorated_function
+
+@app.context_processor
+def inject_replica_notice():
+    return {'replica_notice': g.get('replica_notice')}
+
+@app.cli.command('snapshot-replica')
+def snapshot_replica_command():
+    """Refresh the read replica snapshot now, e.g. from cron, so admin pages never wait for one."""
+    if app.config['REPLICA_MODE'] != 'snapshot':
+        raise click.ClickException("REPLICA_MODE is not 'snapshot'.")
+    started = time.perf_counter()
+    with replica_snapshot_file_lock():
+        take_replica_snapshot()
+    print(f"Snapshot written to {app.config['REPLICA_SNAPSHOT_PATH']} in {time.perf_counter() - started:.2f}s.")
+
+
+# --- Instrumentation ---
+# Per route: request count, wall time (as a histogram), template render time, SQL query
+# count and SQL time. Each request collects its numbers in a small RequestStats object;
+# the global totals are only touched once, when the request ends.
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_REQUEST_STATEMENTS = 5
+
+class RequestStats:
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'template_seconds', 'template_started', 'slowest_statements')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_started = None
+        self.slowest_statements = [] # Min-heap of (seconds, statement), at most SLOW_REQUEST_STATEMENTS long
+
+current_request_stats = ContextVar('current_request_stats', default=None)
+route_metrics = {}
+route_metrics_lock = threading.Lock()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    if current_request_stats.get() is not None:
+        context.statement_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request_stats.get()
+    started = getattr(context, 'statement_started', None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.sql_count += 1
+    stats.sql_seconds += elapsed
+    if len(stats.slowest_statements) < SLOW_REQUEST_STATEMENTS:
+        heapq.heappush(stats.slowest_statements, (elapsed, statement))
+    elif elapsed > stats.slowest_statements[0][0]:
+        heapq.heapreplace(stats.slowest_statements, (elapsed, statement))
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    stats = current_request_stats.get()
+    if stats is not None and stats.template_started is not None:
+        stats.template_seconds += time.perf_counter() - stats.template_started
+        stats.template_started = None
+
+@app.before_request
+def start_request_stats():
+    if app.config['METRICS_ENABLED']:
+        current_request_stats.set(RequestStats())
+
+@app.teardown_request
+def record_request_stats(exc):
+    stats = current_request_stats.get()
+    if stats is None:
+        return
+    current_request_stats.set(None)
+    elapsed = time.perf_counter() - stats.started
+    endpoint = request.endpoint or 'unmatched'
+
+    with route_metrics_lock:
+        metrics = route_metrics.get(endpoint)
+        if metrics is None:
+            metrics = route_metrics[endpoint] = {
+                'requests': 0, 'seconds': 0.0, 'template_seconds': 0.0, 'sql_queries': 0, 'sql_seconds': 0.0,
+                'buckets': [0] * len(REQUEST_DURATION_BUCKETS),
+            }
+        metrics['requests'] += 1
+        metrics['seconds'] += elapsed
+        metrics['template_seconds'] += stats.template_seconds
+        metrics['sql_queries'] += stats.sql_count
+        metrics['sql_seconds'] += stats.sql_seconds
+        for position, upper in enumerate(REQUEST_DURATION_BUCKETS):
+            if elapsed <= upper:
+                metrics['buckets'][position] += 1
+
+    slow_request_ms = app.config['SLOW_REQUEST_MS']
+    if slow_request_ms and elapsed * 1000 >= slow_request_ms:
+        slowest = '\n'.join(f"  {seconds * 1000:.1f} ms: {statement}" for seconds, statement in sorted(stats.slowest_statements, reverse=True))
+        app.logger.warning(
+            f"Slow request {request.method} {request.path} ({endpoint}): {elapsed * 1000:.1f} ms, "
+            f"{stats.sql_count} queries in {stats.sql_seconds * 1000:.1f} ms, "
+            f"templates {stats.template_seconds * 1000:.1f} ms\n{slowest}")
+
+def render_metrics():
+    lines = []
+    with route_metrics_lock:
+        snapshot = {endpoint: dict(metrics, buckets=list(metrics['buckets'])) for endpoint, metrics in route_metrics.items()}
+
+    lines.append('# HELP bank_request_duration_seconds Wall time of requests by endpoint.')
+    lines.append('# TYPE bank_request_duration_seconds histogram')
+    for endpoint, metrics in sorted(snapshot.items()):
+        for upper, count in zip(REQUEST_DURATION_BUCKETS, metrics['buckets']):
+            lines.append(f'bank_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{upper}"}} {count}')
+        lines.append(f'bank_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {metrics["requests"]}')
+        lines.append(f'bank_request_duration_seconds_sum{{endpoint="{endpoint}"}} {metrics["seconds"]:.6f}')
+        lines.append(f'bank_request_duration_seconds_count{{endpoint="{endpoint}"}} {metrics["requests"]}')
+
+    for name, key, help_text in (
+        ('bank_request_template_seconds_total', 'template_seconds', 'Time spent rendering templates.'),
+        ('bank_request_sql_queries_total', 'sql_queries', 'SQL statements executed.'),
+        ('bank_request_sql_seconds_total', 'sql_seconds', 'Time spent in SQL statements.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for endpoint, metrics in sorted(snapshot.items()):
+            value = metrics[key]
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {value:.6f}' if isinstance(value, float) else f'{name}{{endpoint="{endpoint}"}} {value}')
+    pending_events = db.session.query(func.count(OutboxEvent.id)).filter(OutboxEvent.dispatched_at.is_(None)).scalar()
+    lines.append('# HELP bank_outbox_pending_events Outbox events not yet delivered to every sink.')
+    lines.append('# TYPE bank_outbox_pending_events gauge')
+    lines.append(f'bank_outbox_pending_events {pending_events}')
+    return '\n'.join(lines) + '\n'
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    token = app.config['METRICS_TOKEN']
+    authorized_by_token = token and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if 'admin_id' not in session and not authorized_by_token:
+        flash('Please log in to access the admin panel.', 'warning')
+        return redirect(url_for('admin_login'))
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
 # --- Flask Routes ---
 
 @app.route('/')
@@ -137,6 +2247,8 @@ def admin_login():
         admin = Admin.query.filter_by(username=username).first()
 
         if admin and admin.check_password(password):
+            rehash_password_if_needed(admin, password)
+            regenerate_session()
             session['admin_id'] = admin.id
             flash('Logged in successfully!', 'success')
             return redirect(url_for('admin_dashboard'))
@@ -148,10 +2260,11 @@ def admin_login():
 @app.route('/admin/dashboard')
 @admin_login_required
 def admin_dashboard():
-    total_customers = Customer.query.count()
-    total_accounts = Account.query.count()
-    latest_transactions = Transaction.query.order_by(Transaction.date.desc()).limit(10).all()
-    pending_loans_count = Loan.query.filter_by(status='Pending').count()
+    counters = read_counters()
+    total_customers = counters.get('customers', 0)
+    total_accounts = counters.get('accounts', 0)
+    latest_transactions = transactions_with_accounts_query().order_by(Transaction.date.desc()).limit(10).all()
+    pending_loans_count = counters.get('pending_loans', 0)
 
     return render_template('admin_dashboard.html',
                            total_customers=total_customers,
@@ -164,6 +2277,7 @@ def admin_dashboard():
 @admin_login_required
 def admin_logout():
     session.pop('admin_id', None)
+    regenerate_session()
     flash('You have been logged out.', 'info')
     return redirect(url_for('admin_login'))
 
@@ -171,14 +2285,15 @@ def admin_logout():
 
 @app.route('/admin/customers')
 @admin_login_required
+@replica_reads
 def admin_view_customers():
-    customers = Customer.query.order_by(Customer.id).all() # Order by ID for consistency
+    customers = customers_with_accounts_query().order_by(Customer.id).all() # Order by ID for consistency
     return render_template('admin_customers.html', customers=customers)
 
 @app.route('/admin/customer/<int:customer_id>')
 @admin_login_required
 def admin_view_customer_details(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
+    customer = customer_with_accounts_and_loans_query().filter_by(id=customer_id).first_or_404()
 
     customer_accounts = customer.accounts
     customer_loans = customer.loans
@@ -186,7 +2301,7 @@ def admin_view_customer_details(customer_id):
     account_ids = [acc.id for acc in customer_accounts]
     customer_transactions = []
     if account_ids:
-        customer_transactions = Transaction.query.filter(Transaction.account_id.in_(account_ids)).order_by(Transaction.date.desc()).all()
+        customer_transactions = transactions_with_accounts_query().filter(Transaction.account_id.in_(account_ids)).order_by(Transaction.date.desc()).all()
 
     return render_template('admin_customer_details.html',
                            customer=customer,
@@ -222,6 +2337,7 @@ def admin_edit_customer(customer_id):
 
 
         try:
+            mark_customer_changed(customer.id)
             db.session.commit() # Commit changes to the database
             flash(f'Customer "{customer.name}" details updated successfully!', 'success')
             return redirect(url_for('admin_view_customer_details', customer_id=customer.id)) # Redirect to the customer's detail page
@@ -250,6 +2366,13 @@ def admin_delete_customer(customer_id):
         # which will delete associated accounts, loans, and transactions automatically.
         # Be EXTREMELY cautious with real data and cascade delete!
 
+        adjust_counter('customers', -1)
+        adjust_counter('accounts', -len(customer.accounts))
+        adjust_counter('pending_loans', -sum(1 for loan in customer.loans if loan.status == 'Pending'))
+        mark_customer_changed(customer.id)
+        for account in customer.accounts:
+            account_ref_cache.delete(account.account_number)
+
         db.session.delete(customer) # Mark the customer for deletion
         db.session.commit() # Commit the deletion
 
@@ -286,6 +2409,7 @@ def admin_add_customer():
         db.session.add(new_customer)
 
         try:
+            adjust_counter('customers', 1)
             db.session.commit()
             flash(f'Customer "{name}" added successfully! They can now register for an account.', 'success')
             return redirect(url_for('admin_view_customers'))
@@ -298,25 +2422,121 @@ def admin_add_customer():
     return render_template('admin_add_customer.html')
 
 
+# --- Helpers for the Transaction Ledger (keyset pagination) ---
+TRANSACTIONS_PAGE_SIZE = 50
+TRANSACTIONS_MAX_PAGE_SIZE = 500
+TRANSACTIONS_STREAM_BATCH_SIZE = 500
+
+def encode_ledger_cursor(transaction):
+    # Cursor is the (date, id) of the last row shown, e.g. "2024-01-31T10:15:00.123456_42"
+    return f"{transaction.date.isoformat()}_{transaction.id}"
+
+def decode_ledger_cursor(cursor):
+    try:
+        date_part, id_part = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (AttributeError, ValueError):
+        return None
+
+def parse_ledger_filters(args):
+    """Reads the ledger filters from the query string. Invalid values are ignored."""
+    filters = {
+        'date_from': args.get('date_from', '').strip(),
+        'date_to': args.get('date_to', '').strip(),
+        'account_number': args.get('account_number', '').strip(),
+        'transaction_type': args.get('transaction_type', '').strip(),
+    }
+    for key in ('date_from', 'date_to'):
+        if filters[key]:
+            try:
+                datetime.strptime(filters[key], '%Y-%m-%d')
+            except ValueError:
+                filters[key] = ''
+    return filters
+
+def build_ledger_query(filters):
+    query = transactions_with_accounts_query()
+
+    if filters['date_from']:
+        query = query.filter(Transaction.date >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters['date_to']:
+        # The end date is inclusive, so compare against the start of the next day
+        end = datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        query = query.filter(Transaction.date < end)
+    if filters['account_number']:
+        account_ids = db.session.query(Account.id).filter(Account.account_number == filters['account_number'])
+        query = query.filter(Transaction.account_id.in_(account_ids.scalar_subquery()))
+    if filters['transaction_type']:
+        query = query.filter(Transaction.transaction_type == filters['transaction_type'])
+
+    return query.order_by(Transaction.date.desc(), Transaction.id.desc())
+
+def apply_ledger_cursor(query, cursor):
+    # Seek past the last row of the previous page instead of using OFFSET,
+    # so every page costs the same no matter how deep into the ledger it is.
+    cursor_date, cursor_id = cursor
+    return query.filter(or_(
+        Transaction.date < cursor_date,
+        and_(Transaction.date == cursor_date, Transaction.id < cursor_id)
+    ))
+
+
 # --- Admin Route for Transaction Management ---
 @app.route('/admin/transactions')
 @admin_login_required
+@replica_reads
 def admin_view_transactions():
-    transactions = Transaction.query.order_by(Transaction.date.desc()).all()
-    return render_template('admin_transactions.html', transactions=transactions)
+    filters = parse_ledger_filters(request.args)
+    query = build_ledger_query(filters)
+    transaction_types = CREDIT_TRANSACTION_TYPES + DEBIT_TRANSACTION_TYPES
+
+    if request.args.get('stream') == '1':
+        # Streamed mode: render the whole filtered ledger, fetching rows in batches as the template consumes them
+        transactions = query.yield_per(TRANSACTIONS_STREAM_BATCH_SIZE)
+        return Response(stream_template('admin_transactions.html',
+                                        transactions=transactions,
+                                        filters=filters,
+                                        transaction_types=transaction_types,
+                                        streaming=True,
+                                        next_cursor=None,
+                                        page_size=None))
+
+    page_size = request.args.get('page_size', TRANSACTIONS_PAGE_SIZE, type=int)
+    page_size = max(1, min(page_size, TRANSACTIONS_MAX_PAGE_SIZE))
+
+    cursor = decode_ledger_cursor(request.args.get('cursor'))
+    if cursor:
+        query = apply_ledger_cursor(query, cursor)
+
+    # Fetch one extra row to find out whether there is a next page
+    transactions = query.limit(page_size + 1).all()
+    next_cursor = None
+    if len(transactions) > page_size:
+        transactions = transactions[:page_size]
+        next_cursor = encode_ledger_cursor(transactions[-1])
+
+    return render_template('admin_transactions.html',
+                           transactions=transactions,
+                           filters=filters,
+                           transaction_types=transaction_types,
+                           streaming=False,
+                           next_cursor=next_cursor,
+                           page_size=page_size)
 
 # --- Admin Route for Account Management ---
 @app.route('/admin/accounts')
 @admin_login_required
+@replica_reads
 def admin_view_accounts():
-    accounts = Account.query.order_by(Account.account_number).all()
+    accounts = accounts_with_customer_query().order_by(Account.account_number).all()
     return render_template('admin_accounts.html', accounts=accounts)
 
 # --- Admin Routes for Loan Management ---
 @app.route('/admin/loans')
 @admin_login_required
+@replica_reads
 def admin_view_loans():
-    loans = Loan.query.order_by(Loan.application_date.desc()).all()
+    loans = loans_with_customer_and_account_query().order_by(Loan.application_date.desc()).all()
     return render_template('admin_loans.html', loans=loans)
 
 @app.route('/admin/loan/<int:loan_id>')
@@ -326,6 +2546,35 @@ def admin_view_loan_details(loan_id):
     return render_template('admin_loan_details.html', loan=loan)
 
 
+@app.route('/admin/loan/<int:loan_id>/schedule')
+@admin_login_required
+def admin_view_loan_schedule(loan_id):
+    loan = Loan.query.get_or_404(loan_id)
+    try:
+        schedule = amortization_schedule(loan)
+    except InvalidLoanTermsError as e:
+        flash(f'No schedule for loan #{loan.id}: {e}.', 'danger')
+        return redirect(url_for('admin_view_loan_details', loan_id=loan.id))
+    return render_template('loan_schedule.html',
+                           loan=loan,
+                           schedule=schedule,
+                           back_url=url_for('admin_view_loan_details', loan_id=loan.id))
+
+@app.route('/admin/loans/exposure')
+@admin_login_required
+def admin_loan_exposure():
+    refresh = request.args.get('refresh') == '1'
+    exposure = cached_report('loan_exposure', loan_exposure_report, refresh=refresh)
+    return render_template('admin_loan_exposure.html', exposure=exposure)
+
+def decide_pending_loan(loan, status):
+    """Moves a loan out of 'Pending' with a conditional UPDATE. Returns False if another
+    request decided it first, so a loan is never disbursed (or counted) twice."""
+    result = db.session.execute(
+        update(Loan).where(Loan.id == loan.id, Loan.status == 'Pending')
+        .values(status=status, approval_date=datetime.utcnow()))
+    return result.rowcount == 1
+
 @app.route('/admin/loan/<int:loan_id>/approve', methods=['POST'])
 @admin_login_required
 def admin_approve_loan(loan_id):
@@ -333,20 +2582,21 @@ def admin_approve_loan(loan_id):
 
     if loan.status == 'Pending':
         try:
-            loan.status = 'Approved'
-            loan.approval_date = datetime.utcnow()
+            check_loan_terms(loan.interest_rate, loan.term_months)
+        except InvalidLoanTermsError as e:
+            flash(f'Loan #{loan.id} cannot be approved: {e}.', 'danger')
+            return redirect(url_for('admin_view_loan_details', loan_id=loan.id))
+        try:
+            if not decide_pending_loan(loan, 'Approved'):
+                db.session.rollback()
+                flash(f'Loan #{loan.id} was already decided.', 'warning')
+                return redirect(url_for('admin_view_loan_details', loan_id=loan.id))
+            adjust_counter('pending_loans', -1)
+            mark_customer_changed(loan.customer_id)
 
             account = Account.query.get(loan.account_id)
             if account:
-                account.balance += loan.loan_amount
-
-                new_transaction = Transaction(
-                    account_id=account.id,
-                    transaction_type='Loan Disbursement',
-                    amount=loan.loan_amount,
-                    description=f'Loan #{loan.id} disbursed'
-                )
-                db.session.add(new_transaction)
+                post_credit(account, loan.loan_amount, 'Loan Disbursement', f'Loan #{loan.id} disbursed')
             else:
                  flash(f'Account for loan #{loan.id} not found!', 'danger')
                  db.session.rollback()
@@ -375,8 +2625,12 @@ def admin_reject_loan(loan_id):
 
     if loan.status == 'Pending':
         try:
-            loan.status = 'Rejected'
-            loan.approval_date = datetime.utcnow()
+            if not decide_pending_loan(loan, 'Rejected'):
+                db.session.rollback()
+                flash(f'Loan #{loan.id} was already decided.', 'warning')
+                return redirect(url_for('admin_view_loan_details', loan_id=loan.id))
+            adjust_counter('pending_loans', -1)
+            mark_customer_changed(loan.customer_id)
             db.session.commit()
             flash(f'Loan #{loan.id} rejected.', 'warning')
         except Exception as e:
@@ -389,13 +2643,483 @@ def admin_reject_loan(loan_id):
     return redirect(url_for('admin_view_loan_details', loan_id=loan.id))
 
 
-# --- Admin Route for Reporting (Placeholder) ---
+# --- Batch Postings ---
+# Bulk deposits and payroll-style transfers. A batch is a list of postings, each with
+# account_number, amount (rupees) and optionally source_account_number (making it a
+# transfer out of that account) and description. All accounts are resolved up front
+# with IN queries, and valid postings are applied chunk by chunk, one commit per chunk.
+
+BATCH_CHUNK_SIZE = 1000
+BATCH_LOOKUP_SIZE = 5000
+
+def read_postings_file(stream, filename):
+    """Parses a postings file: a JSON list of objects, or CSV with a header row."""
+    data = stream.read()
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if filename.lower().endswith('.json'):
+        postings = json.loads(data)
+        if not isinstance(postings, list):
+            raise ValueError('Expected a JSON list of postings.')
+        return postings
+    return list(csv.DictReader(io.StringIO(data)))
+
+def resolve_account_ids(account_numbers):
+    numbers = list(set(account_numbers))
+    account_ids = {}
+    for start in range(0, len(numbers), BATCH_LOOKUP_SIZE):
+        account_ids.update(db.session.query(Account.account_number, Account.id)
+                           .filter(Account.account_number.in_(numbers[start:start + BATCH_LOOKUP_SIZE])).all())
+    return account_ids
+
+def validate_posting(row, posting, account_ids):
+    """Returns (parsed posting, None) or (None, error message)."""
+    account_number = str(posting.get('account_number') or '').strip()
+    source_account_number = str(posting.get('source_account_number') or '').strip()
+    try:
+        amount = parse_rupees(posting.get('amount'))
+    except ValueError:
+        return None, 'Invalid amount.'
+    if amount <= 0:
+        return None, 'Invalid amount.'
+    if account_number not in account_ids:
+        return None, 'Account not found.'
+    if source_account_number and source_account_number not in account_ids:
+        return None, 'Source account not found.'
+    if source_account_number == account_number:
+        return None, 'Cannot transfer to the same account.'
+
+    return {
+        'row': row,
+        'account_id': account_ids[account_number],
+        'account_number': account_number,
+        'source_id': account_ids.get(source_account_number),
+        'source_account_number': source_account_number,
+        'amount': amount,
+        'description': str(posting.get('description') or '').strip(),
+    }, None
+
+def apply_posting_chunk(chunk, results):
+    # Debit each source account once for all of its rows in the chunk, and only fall
+    # back to row-by-row debits when it cannot cover the whole chunk.
+    applied = [posting for posting in chunk if not posting['source_id']]
+    by_source = {}
+    for posting in chunk:
+        if posting['source_id']:
+            by_source.setdefault(posting['source_id'], []).append(posting)
+    for source_id, postings in by_source.items():
+        try:
+            debit_balance(source_id, sum(posting['amount'] for posting in postings))
+            applied.extend(postings)
+        except InsufficientFundsError:
+            for posting in postings:
+                try:
+                    debit_balance(source_id, posting['amount'])
+                    applied.append(posting)
+                except InsufficientFundsError:
+                    results[posting['row']] = {'row': posting['row'], 'status': 'rejected', 'error': 'Insufficient funds in the source account.'}
+
+    credits = {}
+    for posting in applied:
+        credits[posting['account_id']] = credits.get(posting['account_id'], 0) + posting['amount']
+    account_table = Account.__table__
+    if credits:
+        db.session.execute(
+            update(account_table).where(account_table.c.id == bindparam('credit_account_id'))
+            .values(balance=account_table.c.balance + bindparam('credit_amount')),
+            [{'credit_account_id': account_id, 'credit_amount': amount} for account_id, amount in credits.items()])
+
+    now = datetime.utcnow()
+    transaction_rows = []
+    for posting in applied:
+        suffix = f": {posting['description']}" if posting['description'] else ''
+        if posting['source_id']:
+            transaction_rows.append({'account_id': posting['source_id'], 'transaction_type': 'Transfer (Debit)', 'amount': posting['amount'], 'date': now,
+                                     'description': f"Transfer to Account {posting['account_number']}{suffix}", 'target_account_id': posting['account_id']})
+            transaction_rows.append({'account_id': posting['account_id'], 'transaction_type': 'Transfer (Credit)', 'amount': posting['amount'], 'date': now,
+                                     'description': f"Transfer from Account {posting['source_account_number']}{suffix}", 'target_account_id': posting['source_id']})
+        else:
+            transaction_rows.append({'account_id': posting['account_id'], 'transaction_type': 'Deposit', 'amount': posting['amount'], 'date': now,
+                                     'description': posting['description'] or 'Bulk Deposit', 'target_account_id': None})
+        results[posting['row']] = {'row': posting['row'], 'status': 'posted', 'error': None}
+    if transaction_rows:
+        touched_account_ids = {posting['account_id'] for posting in applied} | {posting['source_id'] for posting in applied if posting['source_id']}
+        # The chunk's debits and credits were applied in bulk: walk back from the resulting
+        # balances to give every row the balance after it, in the order the rows are written.
+        balances = dict(db.session.query(Account.id, Account.balance).filter(Account.id.in_(touched_account_ids)))
+        for row in reversed(transaction_rows):
+            row['balance_after'] = balances[row['account_id']]
+            balances[row['account_id']] -= row['amount'] if row['transaction_type'] in CREDIT_TRANSACTION_TYPES else -row['amount']
+        transaction_ids = db.session.execute(
+            Transaction.__table__.insert().returning(Transaction.__table__.c.id, sort_by_parameter_order=True), transaction_rows).scalars().all()
+        record_posting_events(zip(transaction_ids, transaction_rows))
+        mark_customer_changed(*[customer_id for (customer_id,) in
+                                db.session.query(Account.customer_id).filter(Account.id.in_(touched_account_ids)).distinct()])
+
+def post_batch(postings, chunk_size=BATCH_CHUNK_SIZE):
+    """Validates and applies a list of postings. Returns one result dict per posting, in order."""
+    account_ids = resolve_account_ids(
+        [str(posting.get(key) or '').strip() for posting in postings if isinstance(posting, dict)
+         for key in ('account_number', 'source_account_number')])
+
+    results = [None] * len(postings)
+    valid = []
+    for row, posting in enumerate(postings):
+        if isinstance(posting, dict):
+            parsed, error = validate_posting(row, posting, account_ids)
+        else:
+            parsed, error = None, 'Posting must be an object.'
+        if error:
+            results[row] = {'row': row, 'status': 'rejected', 'error': error}
+        else:
+            valid.append(parsed)
+
+    for start in range(0, len(valid), chunk_size):
+        chunk = valid[start:start + chunk_size]
+        try:
+            apply_posting_chunk(chunk, results)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error posting batch chunk starting at row {chunk[0]['row']}: {e}")
+            for posting in chunk:
+                results[posting['row']] = {'row': posting['row'], 'status': 'failed', 'error': str(e)}
+    return results
+
+@app.route('/admin/postings/batch', methods=['GET', 'POST'])
+@admin_login_required
+def admin_batch_postings():
+    if request.method == 'POST':
+        if request.is_json:
+            payload = request.get_json(silent=True)
+            postings = payload.get('postings') if isinstance(payload, dict) else payload
+            if not isinstance(postings, list):
+                return jsonify({'error': 'Expected a list of postings.'}), 400
+            results = post_batch(postings)
+            return jsonify({
+                'posted': sum(1 for result in results if result['status'] == 'posted'),
+                'results': results,
+            })
+
+        upload = request.files.get('postings_file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV or JSON file of postings.', 'danger')
+            return redirect(url_for('admin_batch_postings'))
+        try:
+            postings = read_postings_file(upload.stream, upload.filename)
+        except (ValueError, csv.Error) as e:
+            flash(f'Could not read postings file: {str(e)}', 'danger')
+            return redirect(url_for('admin_batch_postings'))
+
+        results = post_batch(postings)
+        posted = sum(1 for result in results if result['status'] == 'posted')
+        flash(f'{posted} of {len(results)} postings applied.', 'success' if posted == len(results) else 'warning')
+        return render_template('admin_batch_postings.html', postings=postings, results=results)
+
+    return render_template('admin_batch_postings.html', postings=[], results=[])
+
+@app.cli.command('post-batch')
+@click.argument('postings_file', type=click.File('rb'))
+@click.option('--chunk-size', default=BATCH_CHUNK_SIZE, show_default=True, help='Postings committed per transaction.')
+def post_batch_command(postings_file, chunk_size):
+    """Apply a CSV or JSON file of postings and print a per-row report."""
+    try:
+        postings = read_postings_file(postings_file, postings_file.name)
+    except (ValueError, csv.Error) as e:
+        raise click.ClickException(f'Could not read postings file: {e}')
+    started = time.perf_counter()
+    results = post_batch(postings, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - started
+
+    for result in results:
+        if result['status'] != 'posted':
+            print(f"row {result['row'] + 1}: {result['status']}: {result['error']}")
+    posted = sum(1 for result in results if result['status'] == 'posted')
+    print(f"{posted} of {len(results)} postings applied in {elapsed:.2f}s.")
+
+
+# --- Reports ---
+# Every report is a single GROUP BY query, so the database does the aggregation
+# instead of Python walking ORM objects. Results are cached per time bucket: all
+# page loads within the same REPORT_CACHE_SECONDS window reuse one computation.
+
+REPORT_CACHE_SECONDS = 300
+REPORT_WINDOWS = (7, 30, 90)
+BALANCE_BANDS = ((0, 'Below ₹1,000', 100000), (1, '₹1,000 - ₹10,000', 1000000), (2, '₹10,000 - ₹1,00,000', 10000000))
+report_cache = {}
+
+def cached_report(name, compute, *args, refresh=False):
+    bucket = int(time.time() // REPORT_CACHE_SECONDS)
+    key = (name,) + args
+    cached = report_cache.get(key)
+    if cached and cached[0] == bucket and not refresh:
+        return cached[1]
+    result = {'rows': compute(*args), 'computed_at': datetime.utcnow()}
+    report_cache[key] = (bucket, result)
+    return result
+
+def daily_volume_report(days):
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    day = func.date(Transaction.date)
+
+    def volume(transaction_type):
+        is_type = Transaction.transaction_type == transaction_type
+        return func.sum(case((is_type, 1), else_=0)), func.coalesce(func.sum(case((is_type, Transaction.amount), else_=0)), 0)
+
+    # Each transfer is counted once, through its debit leg
+    rows = db.session.query(day, *volume('Deposit'), *volume('Withdrawal'), *volume('Transfer (Debit)')) \
+        .filter(Transaction.date >= datetime.combine(since, datetime.min.time())) \
+        .group_by(day).order_by(day.desc()).all()
+    return [
+        {'day': row[0], 'deposit_count': row[1], 'deposit_total': row[2], 'withdrawal_count': row[3],
+         'withdrawal_total': row[4], 'transfer_count': row[5], 'transfer_total': row[6]}
+        for row in rows
+    ]
+
+def balance_distribution_report():
+    band = case(*[(Account.balance < upper, position) for position, _, upper in BALANCE_BANDS], else_=len(BALANCE_BANDS))
+    band_labels = [label for _, label, _ in BALANCE_BANDS] + ['₹1,00,000 and above']
+    rows = db.session.query(Account.account_type, band, func.count(Account.id), func.sum(Account.balance)) \
+        .group_by(Account.account_type, band).order_by(Account.account_type, band).all()
+    return [
+        {'account_type': account_type, 'band': band_labels[band_position], 'accounts': count, 'total_balance': total}
+        for account_type, band_position, count, total in rows
+    ]
+
+def loan_book_report():
+    rows = db.session.query(Loan.status, func.count(Loan.id), func.sum(Loan.loan_amount), func.avg(Loan.interest_rate)) \
+        .group_by(Loan.status).order_by(Loan.status).all()
+    return [
+        {'status': status, 'loans': count, 'total_amount': total, 'average_rate': average_rate}
+        for status, count, total, average_rate in rows
+    ]
+
+def top_accounts_report(days, limit=10):
+    since = datetime.utcnow() - timedelta(days=days)
+    activity = db.session.query(
+        Transaction.account_id.label('account_id'),
+        func.count(Transaction.id).label('transactions'),
+        func.sum(Transaction.amount).label('volume')
+    ).filter(Transaction.date >= since).group_by(Transaction.account_id) \
+        .order_by(func.count(Transaction.id).desc()).limit(limit).subquery()
+    rows = db.session.query(Account.account_number, Account.account_type, activity.c.transactions, activity.c.volume) \
+        .join(activity, activity.c.account_id == Account.id) \
+        .order_by(activity.c.transactions.desc()).all()
+    return [
+        {'account_number': account_number, 'account_type': account_type, 'transactions': transactions, 'volume': volume}
+        for account_number, account_type, transactions, volume in rows
+    ]
+
+# --- Admin Route for Reporting ---
 @app.route('/admin/reports')
 @admin_login_required
+@replica_reads
 def admin_reports():
-    # Keeping this as a placeholder for complex reporting
-    flash("Reporting feature is not fully implemented.", 'info')
-    return render_template('admin_reports.html')
+    days = request.args.get('days', 30, type=int)
+    if days not in REPORT_WINDOWS:
+        days = 30
+    refresh = request.args.get('refresh') == '1'
+
+    return render_template('admin_reports.html',
+                           days=days,
+                           report_windows=REPORT_WINDOWS,
+                           daily_volumes=cached_report('daily_volumes', daily_volume_report, days, refresh=refresh),
+                           balance_distribution=cached_report('balance_distribution', balance_distribution_report, refresh=refresh),
+                           loan_book=cached_report('loan_book', loan_book_report, refresh=refresh),
+                           top_accounts=cached_report('top_accounts', top_accounts_report, days, refresh=refresh))
+
+
+# --- Admin Search ---
+SEARCH_PAGE_SIZE = 25
+SEARCH_SCOPES = ('customers', 'accounts', 'transactions')
+
+def full_text_match(query_text):
+    """Turns free text into an FTS5 query matching rows that contain every word as a prefix."""
+    words = re.findall(r'\w+', query_text)
+    return ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+
+def search_index_ids(index_name, query_text, before_id, limit):
+    """Newest-first ids from a full-text index, starting below before_id."""
+    match = full_text_match(query_text)
+    if not match:
+        return []
+    sql = f"SELECT rowid FROM {index_name} WHERE {index_name} MATCH :match"
+    if before_id is not None:
+        sql += " AND rowid < :before_id"
+    sql += " ORDER BY rowid DESC LIMIT :limit"
+    return db.session.execute(text(sql), {'match': match, 'before_id': before_id, 'limit': limit}).scalars().all()
+
+def using_search_indexes():
+    return db.session.get_bind(mapper=Customer).dialect.name == 'sqlite'
+
+def search_customers(query_text, before_id, limit):
+    query = customers_with_accounts_query()
+    if using_search_indexes():
+        query = query.filter(Customer.id.in_(search_index_ids('customer_search', query_text, before_id, limit)))
+    else:
+        pattern = f'%{query_text}%'
+        query = query.filter(or_(Customer.name.ilike(pattern), Customer.contact_info.ilike(pattern)))
+        if before_id is not None:
+            query = query.filter(Customer.id < before_id)
+    return query.order_by(Customer.id.desc()).limit(limit).all()
+
+def search_transactions(query_text, before_id, limit):
+    query = transactions_with_accounts_query()
+    if using_search_indexes():
+        query = query.filter(Transaction.id.in_(search_index_ids('transaction_search', query_text, before_id, limit)))
+    else:
+        query = query.filter(Transaction.description.ilike(f'%{query_text}%'))
+        if before_id is not None:
+            query = query.filter(Transaction.id < before_id)
+    return query.order_by(Transaction.id.desc()).limit(limit).all()
+
+def search_accounts(query_text, after_number, limit):
+    # Account numbers are digits only: a prefix is a range scan on the unique index
+    prefix = re.sub(r'\D', '', query_text)
+    if not prefix:
+        return []
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    query = accounts_with_customer_query().filter(Account.account_number >= prefix, Account.account_number < upper_bound)
+    if after_number:
+        query = query.filter(Account.account_number > after_number)
+    return query.order_by(Account.account_number).limit(limit).all()
+
+@app.route('/admin/search')
+@admin_login_required
+@replica_reads
+def admin_search():
+    query_text = request.args.get('q', '').strip()
+    scope = request.args.get('scope', 'customers')
+    if scope not in SEARCH_SCOPES:
+        scope = 'customers'
+    cursor = request.args.get('cursor') or None
+
+    results, next_cursor = [], None
+    if query_text:
+        # Fetch one extra row to find out whether there is a next page
+        if scope == 'accounts':
+            results = search_accounts(query_text, cursor, SEARCH_PAGE_SIZE + 1)
+        else:
+            before_id = int(cursor) if cursor and cursor.isdigit() else None
+            search = search_customers if scope == 'customers' else search_transactions
+            results = search(query_text, before_id, SEARCH_PAGE_SIZE + 1)
+        if len(results) > SEARCH_PAGE_SIZE:
+            results = results[:SEARCH_PAGE_SIZE]
+            next_cursor = results[-1].account_number if scope == 'accounts' else results[-1].id
+
+    return render_template('admin_search.html',
+                           query_text=query_text,
+                           scope=scope,
+                           scopes=SEARCH_SCOPES,
+                           results=results,
+                           next_cursor=next_cursor)
+
+
+# --- Statement Export ---
+# Statements are streamed: rows are read from the database in batches of STATEMENT_BATCH_SIZE
+# and written out as they arrive, so memory use stays flat however long the history is.
+
+STATEMENT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+STATEMENT_COLUMNS = ('transaction_id', 'date', 'account_number', 'transaction_type', 'amount', 'balance_after', 'related_account_number', 'description')
+STATEMENT_BATCH_SIZE = 1000
+STATEMENT_CHUNK_BYTES = 64 * 1024
+
+def statement_query(filters, customer_id=None):
+    """Plain rows rather than ORM objects, so nothing piles up in the session's identity map."""
+    source = aliased(Account)
+    related = aliased(Account)
+    query = (select(Transaction.id, Transaction.date, source.account_number, Transaction.transaction_type,
+                    Transaction.amount, Transaction.balance_after, related.account_number, Transaction.description)
+             .outerjoin(source, Transaction.account_id == source.id)
+             .outerjoin(related, Transaction.target_account_id == related.id)
+             .order_by(Transaction.date, Transaction.id))
+    if filters['date_from']:
+        query = query.where(Transaction.date >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters['date_to']:
+        query = query.where(Transaction.date < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    if filters['account_number']:
+        query = query.where(source.account_number == filters['account_number'])
+    if filters['transaction_type']:
+        query = query.where(Transaction.transaction_type == filters['transaction_type'])
+    if customer_id is not None:
+        query = query.where(source.customer_id == customer_id)
+    return query.execution_options(yield_per=STATEMENT_BATCH_SIZE)
+
+def statement_chunks(query, statement_format):
+    """Yields the statement as text, roughly STATEMENT_CHUNK_BYTES at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if statement_format == 'csv':
+        writer.writerow(STATEMENT_COLUMNS)
+    for transaction_id, date, account_number, transaction_type, amount, balance_after, related_account_number, description in db.session.execute(query):
+        record = (transaction_id, date.isoformat(sep=' '), account_number, transaction_type, format_rupees(amount),
+                  format_rupees(balance_after) if balance_after is not None else '', related_account_number or '', description or '')
+        if statement_format == 'csv':
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(dict(zip(STATEMENT_COLUMNS, record))) + '\n')
+        if buffer.tell() >= STATEMENT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def encode_statement(chunks, compress):
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(wbits=31) # wbits=31 writes a gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def statement_response(query, statement_format, compress, filename):
+    filename = f'{filename}.{statement_format}' + ('.gz' if compress else '')
+    body = stream_with_context(encode_statement(statement_chunks(query, statement_format), compress))
+    return Response(body,
+                    mimetype='application/gzip' if compress else STATEMENT_FORMATS[statement_format],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def statement_format_from_args(args):
+    statement_format = args.get('format', 'csv')
+    return statement_format if statement_format in STATEMENT_FORMATS else 'csv'
+
+@app.route('/admin/statement')
+@admin_login_required
+@replica_reads
+def admin_export_statement():
+    """Whole bank by default; narrowed by account_number, customer_id, date_from/date_to and transaction_type."""
+    filters = parse_ledger_filters(request.args)
+    customer_id = request.args.get('customer_id', type=int)
+    if customer_id is not None:
+        filename = f'statement-customer-{customer_id}'
+    elif filters['account_number']:
+        filename = f"statement-{filters['account_number']}"
+    else:
+        filename = 'statement-all'
+    return statement_response(statement_query(filters, customer_id=customer_id),
+                              statement_format_from_args(request.args),
+                              request.args.get('gzip') == '1',
+                              filename)
+
+@app.cli.command('export-statement')
+@click.option('--account', 'account_number', default='', help='Only this account number.')
+@click.option('--customer', 'customer_id', type=int, help='Only accounts of this customer id.')
+@click.option('--from', 'date_from', default='', help='First day to include (YYYY-MM-DD).')
+@click.option('--to', 'date_to', default='', help='Last day to include (YYYY-MM-DD).')
+@click.option('--format', 'statement_format', type=click.Choice(list(STATEMENT_FORMATS)), default='csv', show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip.')
+@click.option('--output', type=click.File('wb'), default='-', help='File to write to; stdout by default.')
+def export_statement_command(account_number, customer_id, date_from, date_to, statement_format, compress, output):
+    """Stream a statement for an account, a customer or the whole bank."""
+    filters = parse_ledger_filters({'date_from': date_from, 'date_to': date_to, 'account_number': account_number})
+    if filters['date_from'] != date_from or filters['date_to'] != date_to:
+        raise click.BadParameter('Dates must be in YYYY-MM-DD format.')
+    for data in encode_statement(statement_chunks(statement_query(filters, customer_id=customer_id), statement_format), compress):
+        output.write(data)
 
 
 # --- Customer Routes ---
@@ -433,23 +3157,18 @@ def register():
         db.session.add(new_customer)
 
         try:
+            adjust_counter('customers', 1)
             db.session.commit()
 
-            account_number = str(random.randint(1000000000, 9999999999))
-            existing_account = Account.query.filter_by(account_number=account_number).first()
-            while existing_account:
-                 account_number = str(random.randint(1000000000, 9999999999))
-                 existing_account = Account.query.filter_by(account_number=account_number).first()
-
-
             new_account = Account(
                 customer_id=new_customer.id,
-                account_number=account_number,
+                account_number=account_number_allocator.allocate(),
                 account_type=account_type,
-                balance=0.0
+                balance=0
             )
 
             db.session.add(new_account)
+            adjust_counter('accounts', 1)
             db.session.commit()
 
             flash('Registration successful! Please log in with your contact info and password.', 'success')
@@ -477,6 +3196,8 @@ def customer_login():
         customer = Customer.query.filter_by(contact_info=contact_info).first()
 
         if customer and customer.check_password(password):
+            rehash_password_if_needed(customer, password)
+            regenerate_session()
             session['customer_id'] = customer.id
             flash('Logged in successfully!', 'success')
             return redirect(url_for('customer_dashboard'))
@@ -490,15 +3211,15 @@ def customer_login():
 @customer_login_required
 def customer_dashboard():
     customer_id = session['customer_id']
-    customer = Customer.query.get(customer_id)
+    customer = load_customer_context(customer_id)
 
     if customer is None:
          session.pop('customer_id', None)
          flash('Your account could not be loaded. Please log in again.', 'danger')
          return redirect(url_for('customer_login'))
 
-    customer_accounts = customer.accounts
-    customer_loans = customer.loans
+    customer_accounts = customer['accounts']
+    customer_loans = customer['loans']
 
     return render_template('customer_dashboard.html',
                            customer=customer,
@@ -512,11 +3233,35 @@ def customer_view_account_transactions(account_id):
     customer_id = session['customer_id']
     account = Account.query.filter_by(id=account_id, customer_id=customer_id).first_or_404()
 
-    account_transactions = Transaction.query.filter_by(account_id=account_id).order_by(Transaction.date.desc()).all()
+    filters = parse_ledger_filters(request.args)
+    query = Transaction.query.options(joinedload(Transaction.target_account)).filter_by(account_id=account_id)
+    opening_balance = None
+    if filters['date_from']:
+        period_start = datetime.strptime(filters['date_from'], '%Y-%m-%d')
+        query = query.filter(Transaction.date >= period_start)
+        opening_balance = balance_as_of(account, period_start)
+    if filters['date_to']:
+        query = query.filter(Transaction.date < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    account_transactions = query.order_by(Transaction.date.desc(), Transaction.id.desc()).all()
 
     return render_template('customer_account_transactions.html',
                            account=account,
-                           transactions=account_transactions)
+                           transactions=account_transactions,
+                           filters=filters,
+                           opening_balance=opening_balance)
+
+@app.route('/account/<int:account_id>/statement')
+@customer_login_required
+def customer_export_statement(account_id):
+    customer_id = session['customer_id']
+    account = Account.query.filter_by(id=account_id, customer_id=customer_id).first_or_404()
+
+    filters = parse_ledger_filters(request.args)
+    filters.update(account_number=account.account_number, transaction_type='')
+    return statement_response(statement_query(filters),
+                              statement_format_from_args(request.args),
+                              request.args.get('gzip') == '1',
+                              f'statement-{account.account_number}')
 
 
 # --- Customer Banking Operations ---
@@ -528,27 +3273,26 @@ def customer_deposit(account_id):
     account = Account.query.filter_by(id=account_id, customer_id=customer_id).first_or_404()
 
     if request.method == 'POST':
-        amount = request.form.get('amount', type=float)
+        amount = request.form.get('amount', type=parse_rupees)
 
         if amount is None or amount <= 0:
             flash('Invalid deposit amount.', 'danger')
             return redirect(url_for('customer_deposit', account_id=account.id))
 
-        account.balance += amount
-
-        new_transaction = Transaction(
-            account_id=account.id,
-            transaction_type='Deposit',
-            amount=amount,
-            description='Online Deposit'
-        )
-
-        db.session.add(new_transaction)
+        idempotency_key = idempotency_key_from_request()
+        fingerprint = request_fingerprint('deposit', account.id, amount)
+        stored = find_idempotency_key(customer_id, idempotency_key)
+        if stored is not None:
+            return replay_idempotent_request(stored, fingerprint)
 
         try:
-            db.session.commit()
-            flash(f'Successfully deposited ₹{amount:.2f} into Account {account.account_number}.', 'success')
+            transaction = post_credit(account, amount, 'Deposit', 'Online Deposit')
+            message = f'Successfully deposited ₹{format_rupees(amount)} into Account {account.account_number}.'
+            commit_posting(customer_id, idempotency_key, fingerprint, transaction, message)
+            flash(message, 'success')
             return redirect(url_for('customer_dashboard'))
+        except DuplicateRequestError as e:
+            return replay_idempotent_request(e.stored, fingerprint)
         except Exception as e:
             db.session.rollback()
             flash(f'Error processing deposit: {str(e)}', 'danger')
@@ -556,7 +3300,7 @@ def customer_deposit(account_id):
             return redirect(url_for('customer_deposit', account_id=account.id))
 
 
-    return render_template('customer_deposit.html', account=account)
+    return render_template('customer_deposit.html', account=account, idempotency_key=secrets.token_urlsafe(16))
 
 
 @app.route('/account/<int:account_id>/withdraw', methods=['GET', 'POST'])
@@ -566,38 +3310,42 @@ def customer_withdraw(account_id):
     account = Account.query.filter_by(id=account_id, customer_id=customer_id).first_or_404()
 
     if request.method == 'POST':
-        amount = request.form.get('amount', type=float)
+        amount = request.form.get('amount', type=parse_rupees)
 
         if amount is None or amount <= 0:
             flash('Invalid withdrawal amount.', 'danger')
             return redirect(url_for('customer_withdraw', account_id=account.id))
 
-        if account.balance < amount:
-            flash('Insufficient funds.', 'danger')
-            return redirect(url_for('customer_withdraw', account_id=account.id))
-
-        account.balance -= amount
-
-        new_transaction = Transaction(
-            account_id=account.id,
-            transaction_type='Withdrawal',
-            amount=amount,
-            description='Online Withdrawal'
-        )
-
-        db.session.add(new_transaction)
+        idempotency_key = idempotency_key_from_request()
+        fingerprint = request_fingerprint('withdraw', account.id, amount)
+        stored = find_idempotency_key(customer_id, idempotency_key)
+        if stored is not None:
+            return replay_idempotent_request(stored, fingerprint)
 
         try:
-            db.session.commit()
-            flash(f'Successfully withdrew ₹{amount:.2f} from Account {account.account_number}.', 'success')
+            with velocity_limiter.reserve(customer_id, account.id, amount):
+                transaction = post_debit(account, amount, 'Withdrawal', 'Online Withdrawal')
+                message = f'Successfully withdrew ₹{format_rupees(amount)} from Account {account.account_number}.'
+                commit_posting(customer_id, idempotency_key, fingerprint, transaction, message)
+            flash(message, 'success')
             return redirect(url_for('customer_dashboard'))
+        except DuplicateRequestError as e:
+            return replay_idempotent_request(e.stored, fingerprint)
+        except VelocityLimitError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('customer_withdraw', account_id=account.id))
+        except InsufficientFundsError:
+            db.session.rollback()
+            flash('Insufficient funds.', 'danger')
+            return redirect(url_for('customer_withdraw', account_id=account.id))
         except Exception as e:
             db.session.rollback()
             flash(f'Error processing withdrawal: {str(e)}', 'danger')
             print(f"Error processing withdrawal: {e}")
             return redirect(url_for('customer_withdraw', account_id=account.id))
 
-    return render_template('customer_withdraw.html', account=account)
+    return render_template('customer_withdraw.html', account=account, idempotency_key=secrets.token_urlsafe(16))
 
 
 @app.route('/account/<int:account_id>/transfer', methods=['GET', 'POST'])
@@ -608,7 +3356,7 @@ def customer_transfer(account_id):
 
     if request.method == 'POST':
         target_account_number = request.form.get('target_account_number')
-        amount = request.form.get('amount', type=float)
+        amount = request.form.get('amount', type=parse_rupees)
         description = request.form.get('description')
 
         if amount is None or amount <= 0:
@@ -619,7 +3367,7 @@ def customer_transfer(account_id):
              flash('Target account number is required.', 'danger')
              return redirect(url_for('customer_transfer', account_id=source_account.id))
 
-        target_account = Account.query.filter_by(account_number=target_account_number).first()
+        target_account = resolve_account_number(target_account_number)
 
         if not target_account:
             flash('Target account not found.', 'danger')
@@ -629,42 +3377,44 @@ def customer_transfer(account_id):
             flash('Cannot transfer to the same account.', 'danger')
             return redirect(url_for('customer_transfer', account_id=source_account.id))
 
-        if source_account.balance < amount:
-            flash('Insufficient funds in the source account.', 'danger')
-            return redirect(url_for('customer_transfer', account_id=source_account.id))
+        # Moving money between the customer's own accounts never counts as a new payee
+        payee_account_id = target_account.id if target_account.customer_id != customer_id else None
+        idempotency_key = idempotency_key_from_request()
+        fingerprint = request_fingerprint('transfer', source_account.id, target_account.id, amount, description)
+        stored = find_idempotency_key(customer_id, idempotency_key)
+        if stored is not None:
+            return replay_idempotent_request(stored, fingerprint)
 
         try:
-            source_account.balance -= amount
-            debit_transaction = Transaction(
-                account_id=source_account.id,
-                transaction_type='Transfer (Debit)',
-                amount=amount,
-                description=f'Transfer to Account {target_account.account_number}' + (f': {description}' if description else ''),
-                target_account_id=target_account.id
-            )
-            db.session.add(debit_transaction)
-
-            target_account.balance += amount
-            credit_transaction = Transaction(
-                account_id=target_account.id,
-                transaction_type='Transfer (Credit)',
-                amount=amount,
-                description=f'Transfer from Account {source_account.account_number}' + (f': {description}' if description else ''),
-                target_account_id=source_account.id
-            )
-            db.session.add(credit_transaction)
-
-            db.session.commit()
-            flash(f'Successfully transferred ₹{amount:.2f} from Account {source_account.account_number} to Account {target_account.account_number}.', 'success')
+            with velocity_limiter.reserve(customer_id, source_account.id, amount, payee_account_id):
+                debit_transaction, _ = post_transfer(source_account, target_account, amount, description)
+                message = f'Successfully transferred ₹{format_rupees(amount)} from Account {source_account.account_number} to Account {target_account.account_number}.'
+                commit_posting(customer_id, idempotency_key, fingerprint, debit_transaction, message)
+            flash(message, 'success')
             return redirect(url_for('customer_dashboard'))
 
+        except DuplicateRequestError as e:
+            return replay_idempotent_request(e.stored, fingerprint)
+        except VelocityLimitError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('customer_transfer', account_id=source_account.id))
+        except InsufficientFundsError:
+            db.session.rollback()
+            flash('Insufficient funds in the source account.', 'danger')
+            return redirect(url_for('customer_transfer', account_id=source_account.id))
+        except AccountNotFoundError:
+            db.session.rollback()
+            account_ref_cache.delete(target_account_number)
+            flash('Target account not found.', 'danger')
+            return redirect(url_for('customer_transfer', account_id=source_account.id))
         except Exception as e:
             db.session.rollback()
             flash(f'Error processing transfer: {str(e)}', 'danger')
             print(f"Error processing transfer: {e}")
             return redirect(url_for('customer_transfer', account_id=source_account.id))
 
-    return render_template('customer_transfer.html', account=source_account)
+    return render_template('customer_transfer.html', account=source_account, idempotency_key=secrets.token_urlsafe(16))
 
 # --- Customer Loan Operations ---
 
@@ -672,26 +3422,36 @@ def customer_transfer(account_id):
 @customer_login_required
 def customer_apply_loan():
     customer_id = session['customer_id']
-    customer = Customer.query.get(customer_id)
-    customer_accounts = customer.accounts
+    customer = load_customer_context(customer_id)
+    if customer is None:
+        session.pop('customer_id', None)
+        flash('Your account could not be loaded. Please log in again.', 'danger')
+        return redirect(url_for('customer_login'))
+    customer_accounts = customer['accounts']
 
     if request.method == 'POST':
-        loan_amount = request.form.get('loan_amount', type=float)
+        loan_amount = request.form.get('loan_amount', type=parse_rupees)
         term_months = request.form.get('term_months', type=int)
         interest_rate = request.form.get('interest_rate', type=float)
         account_id = request.form.get('account_id', type=int)
 
-        if loan_amount is None or loan_amount <= 0 or term_months is None or term_months <= 0 or interest_rate is None or interest_rate < 0 or account_id is None:
+        if loan_amount is None or loan_amount <= 0 or account_id is None:
             flash('Invalid loan details.', 'danger')
             return render_template('customer_apply_loan.html', customer_accounts=customer_accounts, form_data=request.form)
 
+        try:
+            check_loan_terms(interest_rate, term_months)
+        except InvalidLoanTermsError as e:
+            flash(f'Invalid loan details: {e}.', 'danger')
+            return render_template('customer_apply_loan.html', customer_accounts=customer_accounts, form_data=request.form)
+
         target_account = Account.query.filter_by(id=account_id, customer_id=customer_id).first()
         if not target_account:
             flash('Invalid account selected for disbursement.', 'danger')
             return render_template('customer_apply_loan.html', customer_accounts=customer_accounts, form_data=request.form)
 
         new_loan = Loan(
-            customer_id=customer.id,
+            customer_id=customer_id,
             account_id=target_account.id,
             loan_amount=loan_amount,
             interest_rate=interest_rate,
@@ -702,6 +3462,8 @@ def customer_apply_loan():
         db.session.add(new_loan)
 
         try:
+            adjust_counter('pending_loans', 1)
+            mark_customer_changed(customer_id)
             db.session.commit()
             flash('Loan application submitted successfully. Status is Pending.', 'success')
             return redirect(url_for('customer_view_loans'))
@@ -717,23 +3479,792 @@ def customer_apply_loan():
 @customer_login_required
 def customer_view_loans():
     customer_id = session['customer_id']
-    customer = Customer.query.get(customer_id)
-    customer_loans = customer.loans
+    customer = load_customer_context(customer_id)
+    if customer is None:
+        session.pop('customer_id', None)
+        flash('Your account could not be loaded. Please log in again.', 'danger')
+        return redirect(url_for('customer_login'))
+    customer_loans = customer['loans']
 
     return render_template('customer_view_loans.html', customer_loans=customer_loans)
 
 
+@app.route('/loan/<int:loan_id>/schedule')
+@customer_login_required
+def customer_view_loan_schedule(loan_id):
+    customer_id = session['customer_id']
+    loan = Loan.query.filter_by(id=loan_id, customer_id=customer_id).first_or_404()
+    try:
+        schedule = amortization_schedule(loan)
+    except InvalidLoanTermsError as e:
+        flash(f'No schedule for loan #{loan.id}: {e}.', 'danger')
+        return redirect(url_for('customer_view_loans'))
+    return render_template('loan_schedule.html',
+                           loan=loan,
+                           schedule=schedule,
+                           back_url=url_for('customer_view_loans'))
+
+
 @app.route('/logout')
 @customer_login_required
 def customer_logout():
     session.pop('customer_id', None)
+    regenerate_session()
     flash('You have been logged out.', 'info')
     return redirect(url_for('customer_login'))
 
 
+# --- Benchmarks ---
+
+def create_scratch_app(database_uri, sqlite_profile=None):
+    """Returns a second app bound to another database, so benchmarks never touch bank.db.
+
+    It uses the main app's storage profile unless sqlite_profile is given.
+    """
+    scratch_app = Flask(__name__) # No request hooks, so it never starts the outbox dispatcher
+    scratch_app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    scratch_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    for key in ('SQLITE_PROFILE', 'SQLITE_SYNCHRONOUS', 'SQLITE_BUSY_TIMEOUT_MS', 'SQLITE_MMAP_SIZE'):
+        scratch_app.config[key] = app.config[key]
+    if sqlite_profile is not None:
+        scratch_app.config['SQLITE_PROFILE'] = sqlite_profile
+    db.init_app(scratch_app)
+    enable_sqlite_profile(scratch_app)
+    with scratch_app.app_context():
+        create_schema()
+    return scratch_app
+
+HOT_QUERIES = [
+    ('Account statement', 'SELECT * FROM "transaction" WHERE account_id = :account_id ORDER BY date DESC'),
+    ('Customer details transactions', 'SELECT * FROM "transaction" WHERE account_id IN (:account_id, :other_account_id) ORDER BY date DESC'),
+    ('Admin ledger page', 'SELECT * FROM "transaction" ORDER BY date DESC, id DESC LIMIT 51'),
+    ('Incoming transfers', 'SELECT count(*) FROM "transaction" WHERE target_account_id = :account_id'),
+    ('Pending loan count', "SELECT count(*) FROM loan WHERE status = 'Pending'"),
+    ('Customer loans', 'SELECT * FROM loan WHERE customer_id = :customer_id'),
+]
+
+def run_hot_queries(engine, params, repeat=5):
+    with engine.connect() as connection:
+        for label, sql in HOT_QUERIES:
+            plan = connection.execute(text('EXPLAIN QUERY PLAN ' + sql), params).fetchall()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"  {label}: {statistics.median(timings):.2f} ms")
+            print(f"    plan: {'; '.join(row[-1] for row in plan)}")
+
+@app.cli.command('bench-indexes')
+@click.option('--rows', default=200000, show_default=True, help='Number of transaction rows to generate.')
+def bench_indexes_command(rows):
+    """Compare query plans and timings of the hot queries with and without the indexes.
+
+    Runs against a throwaway in-memory SQLite database, not bank.db.
+    """
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+
+    customer_count = max(rows // 100, 2)
+    rng = random.Random(42)
+    start_date = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(Customer.__table__.insert(), [
+            {'id': i, 'name': f'Customer {i}', 'contact_info': f'customer{i}@example.com', 'password_hash': '-'}
+            for i in range(1, customer_count + 1)
+        ])
+        connection.execute(Account.__table__.insert(), [
+            {'id': i, 'customer_id': i, 'account_number': str(1000000000 + i), 'account_type': 'Savings', 'balance': 0, 'opening_date': start_date}
+            for i in range(1, customer_count + 1)
+        ])
+        connection.execute(Transaction.__table__.insert(), [
+            {'account_id': rng.randint(1, customer_count), 'transaction_type': 'Deposit', 'amount': 10000,
+             'date': start_date + timedelta(minutes=i), 'target_account_id': rng.randint(1, customer_count) if i % 5 == 0 else None}
+            for i in range(rows)
+        ])
+        connection.execute(Loan.__table__.insert(), [
+            {'customer_id': i, 'account_id': i, 'loan_amount': 100000, 'interest_rate': 10.0, 'term_months': 12,
+             'status': rng.choice(['Pending', 'Approved', 'Approved', 'Rejected']), 'application_date': start_date}
+            for i in range(1, customer_count + 1)
+        ])
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(connection)
+
+    params = {'account_id': 1, 'other_account_id': 2, 'customer_id': 1}
+    print(f"Seeded {rows} transactions, {customer_count} customers, accounts and loans.")
+    print("Without indexes:")
+    run_hot_queries(engine, params)
+
+    with engine.begin() as connection:
+        create_missing_indexes(connection)
+        connection.execute(text('ANALYZE'))
+    print("With indexes:")
+    run_hot_queries(engine, params)
+
+
+@app.cli.command('stress-postings')
+@click.option('--workers', default=8, show_default=True, help='Number of concurrent worker threads.')
+@click.option('--operations', default=300, show_default=True, help='Postings attempted by each worker.')
+@click.option('--accounts', default=5, show_default=True, help='Number of accounts to move money between.')
+def stress_postings_command(workers, operations, accounts):
+    """Hammer the posting engine from concurrent workers and check that no money is created or lost.
+
+    Runs against a throwaway SQLite file, not bank.db.
+    """
+    opening_balance = 100000
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scratch_app = create_scratch_app('sqlite:///' + os.path.join(tmp_dir, 'stress.db'))
+
+        with scratch_app.app_context():
+            customer = Customer(name='Stress Test', contact_info='stress@example.com', password_hash='-')
+            db.session.add(customer)
+            db.session.flush()
+            for i in range(accounts):
+                db.session.add(Account(customer_id=customer.id, account_number=str(9000000000 + i), account_type='Savings', balance=opening_balance))
+            db.session.commit()
+            account_ids = [account_id for (account_id,) in db.session.query(Account.id)]
+
+        outcomes = {'deposit': 0, 'withdrawal': 0, 'transfer': 0, 'insufficient_funds': 0, 'busy': 0}
+        net_inflow = [0]
+        outcomes_lock = threading.Lock()
+
+        def run_worker(seed):
+            rng = random.Random(seed)
+            with scratch_app.app_context():
+                for _ in range(operations):
+                    kind = rng.choice(('deposit', 'withdrawal', 'transfer'))
+                    amount = rng.randint(1, 40000)
+                    source = db.session.get(Account, rng.choice(account_ids))
+                    try:
+                        if kind == 'deposit':
+                            post_credit(source, amount, 'Deposit', 'Stress deposit')
+                        elif kind == 'withdrawal':
+                            post_debit(source, amount, 'Withdrawal', 'Stress withdrawal')
+                        else:
+                            target = db.session.get(Account, rng.choice([i for i in account_ids if i != source.id]))
+                            post_transfer(source, target, amount, 'Stress transfer')
+                        db.session.commit()
+                    except InsufficientFundsError:
+                        db.session.rollback()
+                        kind, amount = 'insufficient_funds', 0
+                    except OperationalError:
+                        db.session.rollback()
+                        kind, amount = 'busy', 0
+                    with outcomes_lock:
+                        outcomes[kind] += 1
+                        net_inflow[0] += {'deposit': amount, 'withdrawal': -amount}.get(kind, 0)
+
+        threads = [threading.Thread(target=run_worker, args=(seed,)) for seed in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with scratch_app.app_context():
+            ledger_sums = dict(db.session.query(Transaction.account_id, func.sum(signed_amount())).group_by(Transaction.account_id).all())
+            balances = dict(db.session.query(Account.id, Account.balance).all())
+
+        print(f"{workers} workers x {operations} operations in {elapsed:.2f}s: {outcomes}")
+        problems = []
+        expected_total = opening_balance * accounts + net_inflow[0]
+        if sum(balances.values()) != expected_total:
+            problems.append(f"total balance {sum(balances.values())} != expected {expected_total}")
+        for account_id, balance in balances.items():
+            if balance < 0:
+                problems.append(f"account {account_id} is overdrawn: {balance}")
+            if balance != opening_balance + ledger_sums.get(account_id, 0):
+                problems.append(f"account {account_id} balance {balance} does not match its transactions")
+
+        for problem in problems:
+            print(f"FAIL: {problem}")
+        if problems:
+            raise SystemExit(1)
+        print(f"OK: total balance {expected_total} matches deposits minus withdrawals, no account overdrawn.")
+
+
+@app.cli.command('bench-sqlite-profile')
+@click.option('--workers', default=8, show_default=True, help='Concurrent workers; half read, half write.')
+@click.option('--seconds', default=5.0, show_default=True, help='How long each run lasts.')
+@click.option('--accounts', default=50, show_default=True, help='Number of accounts to read and post to.')
+def bench_sqlite_profile_command(workers, seconds, accounts):
+    """Compare read and write throughput under concurrent workers with and without the SQLite profile.
+
+    Runs against throwaway SQLite files, not bank.db.
+    """
+    results = []
+    for sqlite_profile in (False, True):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scratch_app = create_scratch_app('sqlite:///' + os.path.join(tmp_dir, 'profile.db'), sqlite_profile=sqlite_profile)
+
+            with scratch_app.app_context():
+                customer = Customer(name='Profile Bench', contact_info='profile@example.com', password_hash='-')
+                db.session.add(customer)
+                db.session.flush()
+                for i in range(accounts):
+                    db.session.add(Account(customer_id=customer.id, account_number=str(9100000000 + i), account_type='Savings', balance=0))
+                db.session.commit()
+                account_ids = [account_id for (account_id,) in db.session.query(Account.id)]
+                for account in db.session.query(Account):
+                    for _ in range(20):
+                        post_credit(account, 100, 'Deposit', 'Seed deposit')
+                db.session.commit()
+
+            counts = {'reads': 0, 'writes': 0, 'busy': 0}
+            counts_lock = threading.Lock()
+            deadline = time.perf_counter() + seconds
+
+            def run_worker(seed, writer):
+                rng = random.Random(seed)
+                done = busy = 0
+                with scratch_app.app_context():
+                    while time.perf_counter() < deadline:
+                        account_id = rng.choice(account_ids)
+                        try:
+                            if writer:
+                                post_credit(db.session.get(Account, account_id), 100, 'Deposit', 'Bench deposit')
+                                db.session.commit()
+                            else:
+                                db.session.query(Transaction).filter_by(account_id=account_id).order_by(Transaction.date.desc()).limit(20).all()
+                                db.session.query(Account.balance).filter_by(id=account_id).scalar()
+                                db.session.rollback() # End the read transaction so WAL checkpoints are not held back
+                            done += 1
+                        except OperationalError:
+                            db.session.rollback()
+                            busy += 1
+                with counts_lock:
+                    counts['writes' if writer else 'reads'] += done
+                    counts['busy'] += busy
+
+            threads = [threading.Thread(target=run_worker, args=(seed, seed % 2 == 0)) for seed in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with scratch_app.app_context():
+                journal_mode = db.session.execute(text('PRAGMA journal_mode')).scalar()
+                db.session.remove()
+            with scratch_app.app_context():
+                db.engine.dispose()
+            results.append(('profile' if sqlite_profile else 'defaults', journal_mode, counts))
+
+    print(f"{workers} workers ({(workers + 1) // 2} writing, {workers // 2} reading) for {seconds:.1f}s each")
+    print(f"{'Settings':<10} {'Journal':>8} {'Reads/s':>10} {'Writes/s':>10} {'Busy':>6}")
+    for label, journal_mode, counts in results:
+        print(f"{label:<10} {journal_mode:>8} {counts['reads'] / seconds:>10.1f} {counts['writes'] / seconds:>10.1f} {counts['busy']:>6}")
+
+
+@app.cli.command('bench-password-hashing')
+@click.option('--logins', default=200, show_default=True, help='Password verifications per measurement.')
+@click.option('--concurrency', default=os.cpu_count() or 1, show_default=True, help='Simultaneous logins.')
+def bench_password_hashing_command(logins, concurrency):
+    """Measure password verifications per second, inline and through the process pool."""
+    global password_hash_pool
+    method = app.config['PASSWORD_HASH_METHOD']
+    stored_hash = generate_password_hash('correct horse', method)
+    cores = min(concurrency, os.cpu_count() or 1)
+    configured_workers = app.config['PASSWORD_HASH_WORKERS']
+
+    for label, workers in (('inline', 0), (f'process pool ({cores} workers)', cores)):
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        password_hash_pool = None
+        verify_password(stored_hash, 'warm up') # Start the pool outside the measurement
+        with ThreadPoolExecutor(max_workers=concurrency) as requests:
+            started = time.perf_counter()
+            list(requests.map(lambda _: verify_password(stored_hash, 'correct horse'), range(logins)))
+            elapsed = time.perf_counter() - started
+        print(f"{method}, {label}: {logins / elapsed:.1f} logins/s, {logins / elapsed / cores:.1f} per core")
+        if password_hash_pool is not None:
+            password_hash_pool.shutdown()
+
+    app.config['PASSWORD_HASH_WORKERS'] = configured_workers
+    password_hash_pool = None
+
+
+# --- Seeding ---
+# seed-db bulk-loads generated customers, accounts, postings and loans with core
+# executemany inserts, one transaction per chunk. Money only moves through postings, so
+# balances, balance_after, counters and transfer pairs all reconcile afterwards. The
+# full-text triggers are dropped during the load and the indexes rebuilt once at the end.
+
+SEED_CHUNK_SIZE = 50000
+SEED_FIRST_NAMES = ('Aarav', 'Ananya', 'Arjun', 'Bhavana', 'Chetan', 'Deepa', 'Ganesh', 'Harini', 'Kavya', 'Kiran',
+                    'Lakshmi', 'Manjunath', 'Meera', 'Naveen', 'Pooja', 'Prakash', 'Rahul', 'Shreya', 'Suresh', 'Vidya')
+SEED_LAST_NAMES = ('Acharya', 'Bhat', 'Gowda', 'Hegde', 'Iyer', 'Kamath', 'Kulkarni', 'Murthy', 'Naik', 'Nair',
+                   'Patil', 'Pai', 'Rao', 'Reddy', 'Shenoy', 'Shetty', 'Sharma', 'Desai', 'Joshi', 'Kumar')
+SEED_CITIES = ('Bengaluru', 'Mysuru', 'Mangaluru', 'Hubballi', 'Belagavi', 'Kalaburagi', 'Davanagere', 'Ballari', 'Shivamogga', 'Tumakuru')
+SEED_KEPT_TABLES = ('admin', 'schema_migration', 'bank_counter')
+
+def drop_search_triggers(connection):
+    if connection.dialect.name != 'sqlite':
+        return
+    for index_name in SEARCH_INDEXES:
+        for suffix in ('insert', 'delete', 'update'):
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {index_name}_{suffix}"))
+
+def seed_amount(rng, median_rupees, sigma):
+    """Log-normally distributed amount in paise: mostly near the median, with a long tail."""
+    return max(100, int(rng.lognormvariate(math.log(median_rupees * 100), sigma)))
+
+def seed_password_hashes(passwords, method, pool):
+    if pool is None:
+        return [generate_password_hash(password, method) for password in passwords]
+    return list(pool.map(generate_password_hash, passwords, itertools.repeat(method), chunksize=64))
+
+def seed_bank_data(engine, customers, transactions, loans, days=365, seed=42, password='password',
+                   distinct_passwords=False, hash_workers=0, chunk_size=SEED_CHUNK_SIZE, progress=None):
+    """Inserts generated data after whatever is already there; returns the counts inserted.
+
+    Customers get 1-3 accounts. Activity per account is heavy-tailed, amounts log-normal.
+    Loans are applied for over the whole period; approved ones are disbursed and repaid
+    monthly while the account can cover the installment.
+    """
+    rng = random.Random(seed)
+    report = progress or (lambda message: None)
+    method = app.config['PASSWORD_HASH_METHOD']
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+
+    with engine.begin() as connection:
+        drop_search_triggers(connection)
+        next_ids = {model: (connection.execute(select(func.max(model.__table__.c.id))).scalar() or 0) + 1
+                    for model in (Customer, Account, Transaction, Loan, LoanRepayment)}
+        accounts_per_customer = rng.choices((1, 2, 3), weights=(70, 25, 5), k=customers)
+        total_accounts = sum(accounts_per_customer)
+        counters = BankCounter.__table__
+        connection.execute(update(counters).where(counters.c.name == 'account_number_sequence')
+                           .values(value=counters.c.value + total_accounts))
+        first_sequence = connection.execute(
+            select(counters.c.value).where(counters.c.name == 'account_number_sequence')).scalar() - total_accounts + 1
+
+    # Customers and accounts. Account i has id first_account_id + i.
+    first_account_id = next_ids[Account]
+    account_customer_ids = []
+    shared_hash = None if distinct_passwords else generate_password_hash(password, method)
+    pool = ProcessPoolExecutor(max_workers=hash_workers) if distinct_passwords and hash_workers else None
+    try:
+        for chunk_start in range(0, customers, chunk_size):
+            customer_ids = range(next_ids[Customer] + chunk_start, next_ids[Customer] + min(chunk_start + chunk_size, customers))
+            if distinct_passwords:
+                password_hashes = seed_password_hashes([f'{password}{customer_id}' for customer_id in customer_ids], method, pool)
+            else:
+                password_hashes = itertools.repeat(shared_hash)
+            customer_rows, account_rows = [], []
+            for customer_id, password_hash, account_count in zip(customer_ids, password_hashes, accounts_per_customer[chunk_start:]):
+                first_name, last_name = rng.choice(SEED_FIRST_NAMES), rng.choice(SEED_LAST_NAMES)
+                customer_rows.append({'id': customer_id, 'name': f'{first_name} {last_name}',
+                                      'address': f'{rng.randint(1, 999)}, {rng.randint(1, 40)}th Cross, {rng.choice(SEED_CITIES)}',
+                                      'contact_info': f'{first_name.lower()}.{last_name.lower()}.{customer_id}@example.com',
+                                      'password_hash': password_hash})
+                for number in range(account_count):
+                    index = len(account_customer_ids)
+                    account_customer_ids.append(customer_id)
+                    account_rows.append({'id': first_account_id + index, 'customer_id': customer_id,
+                                         'account_number': format_account_number(first_sequence + index),
+                                         'account_type': 'Savings' if number == 0 else rng.choice(('Savings', 'Current')),
+                                         'balance': 0, 'opening_date': start - timedelta(days=rng.randint(0, 3650))})
+            with engine.begin() as connection:
+                connection.execute(Customer.__table__.insert(), customer_rows)
+                connection.execute(Account.__table__.insert(), account_rows)
+            report(f"{customer_ids.stop - next_ids[Customer]} / {customers} customers")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    # Loans: the rows go in now; disbursements and repayments are events in the posting stream
+    loan_rows, events = [], []
+    for number in range(loans):
+        account_index = rng.randrange(total_accounts)
+        applied_at = start + timedelta(seconds=rng.randrange(max(days, 1) * 24 * 3600))
+        status = rng.choices(('Approved', 'Pending', 'Rejected'), weights=(60, 25, 15))[0]
+        loan = {'id': next_ids[Loan] + number, 'customer_id': account_customer_ids[account_index],
+                'account_id': first_account_id + account_index,
+                'loan_amount': min(seed_amount(rng, 200000, 0.9), 5000000 * 100),
+                'interest_rate': rng.choice((8.5, 9.25, 10.0, 11.5, 13.0)), 'term_months': rng.choice((12, 24, 36, 60, 84)),
+                'status': status, 'application_date': applied_at,
+                'approval_date': applied_at + timedelta(days=rng.randint(1, 7)) if status == 'Approved' else None,
+                'installments_paid': 0}
+        loan_rows.append(loan)
+        if status == 'Approved' and loan['approval_date'] < end:
+            heapq.heappush(events, (loan['approval_date'], number, 0))
+    for chunk_start in range(0, len(loan_rows), chunk_size):
+        with engine.begin() as connection:
+            connection.execute(Loan.__table__.insert(), loan_rows[chunk_start:chunk_start + chunk_size])
+
+    # Postings, in date order
+    balances = [0] * total_accounts
+    activity = list(itertools.accumulate(rng.paretovariate(1.2) for _ in range(total_accounts)))
+    transaction_rows, repayment_rows = [], []
+    counts = {'customers': customers, 'accounts': total_accounts, 'transactions': 0, 'loans': loans, 'repayments': 0}
+
+    def post(account_index, transaction_type, amount, date, description, target_index=None):
+        balances[account_index] += amount if transaction_type in CREDIT_TRANSACTION_TYPES else -amount
+        transaction_id = next_ids[Transaction] + counts['transactions']
+        counts['transactions'] += 1
+        transaction_rows.append({'id': transaction_id, 'account_id': first_account_id + account_index, 'transaction_type': transaction_type,
+                                 'amount': amount, 'date': date, 'description': description, 'balance_after': balances[account_index],
+                                 'target_account_id': None if target_index is None else first_account_id + target_index})
+        return transaction_id
+
+    def flush():
+        with engine.begin() as connection:
+            if transaction_rows:
+                connection.execute(Transaction.__table__.insert(), transaction_rows)
+            if repayment_rows:
+                connection.execute(LoanRepayment.__table__.insert(), repayment_rows)
+        transaction_rows.clear()
+        repayment_rows.clear()
+        report(f"{counts['transactions']} postings")
+
+    def run_loan_events(until):
+        while events and events[0][0] <= until:
+            date, number, installment = heapq.heappop(events)
+            loan = loan_rows[number]
+            account_index = loan['account_id'] - first_account_id
+            if installment == 0:
+                post(account_index, 'Loan Disbursement', loan['loan_amount'], date, f"Loan #{loan['id']} disbursed")
+            else:
+                amount = installment_payment(Loan(**{key: loan[key] for key in ('loan_amount', 'interest_rate', 'term_months', 'approval_date')}), installment)
+                if balances[account_index] < amount:
+                    continue # Missed: left for the repayment run to collect
+                transaction_id = post(account_index, 'Loan Repayment', amount, date,
+                                      f"Loan #{loan['id']} installment {installment}/{loan['term_months']}")
+                repayment_rows.append({'id': next_ids[LoanRepayment] + counts['repayments'],
+                                       'loan_id': loan['id'], 'installment_number': installment, 'due_date': date,
+                                       'amount': amount, 'status': 'Paid', 'attempted_at': date, 'transaction_id': transaction_id})
+                counts['repayments'] += 1
+                loan['installments_paid'] = installment
+                if installment == loan['term_months']:
+                    loan['status'] = 'Closed'
+            if installment < loan['term_months']:
+                due_date = add_months(loan['approval_date'], installment + 1)
+                if due_date <= end:
+                    heapq.heappush(events, (due_date, number, installment + 1))
+
+    span = (end - start).total_seconds()
+    for number in range(transactions):
+        date = start + timedelta(seconds=span * number / max(transactions, 1))
+        run_loan_events(date)
+        account_index = rng.choices(range(total_accounts), cum_weights=activity)[0]
+        amount = seed_amount(rng, 1500, 1.1)
+        kind = rng.random()
+        if kind < 0.3 and balances[account_index] >= amount:
+            post(account_index, 'Withdrawal', amount, date, rng.choice(('ATM Withdrawal', 'Online Withdrawal', 'Cheque Withdrawal')))
+        elif kind < 0.65 and balances[account_index] >= amount and total_accounts > 1:
+            target_index = rng.randrange(total_accounts - 1)
+            target_index += target_index >= account_index # Any account but this one
+            note = rng.choice(('Rent', 'Groceries', 'School fees', 'Electricity bill', 'Family support', 'Shop payment'))
+            post(account_index, 'Transfer (Debit)', amount, date, f"Transfer to Account {format_account_number(first_sequence + target_index)}: {note}", target_index)
+            post(target_index, 'Transfer (Credit)', amount, date, f"Transfer from Account {format_account_number(first_sequence + account_index)}: {note}", account_index)
+        else:
+            post(account_index, 'Deposit', amount, date, rng.choice(('Cash Deposit', 'Online Deposit', 'Salary Credit')))
+        if len(transaction_rows) >= chunk_size:
+            flush()
+    run_loan_events(end)
+    flush()
+
+    account_table, loan_table = Account.__table__, Loan.__table__
+    with engine.begin() as connection:
+        for chunk_start in range(0, total_accounts, chunk_size):
+            connection.execute(update(account_table).where(account_table.c.id == bindparam('seed_account_id')).values(balance=bindparam('seed_balance')),
+                               [{'seed_account_id': first_account_id + index, 'seed_balance': balances[index]}
+                                for index in range(chunk_start, min(chunk_start + chunk_size, total_accounts))])
+        repaid_loans = [{'seed_loan_id': loan['id'], 'seed_paid': loan['installments_paid'], 'seed_status': loan['status']}
+                        for loan in loan_rows if loan['installments_paid']]
+        if repaid_loans:
+            connection.execute(update(loan_table).where(loan_table.c.id == bindparam('seed_loan_id'))
+                               .values(installments_paid=bindparam('seed_paid'), status=bindparam('seed_status')), repaid_loans)
+        rebuild_counters(connection)
+        report('Rebuilding search indexes')
+        create_search_indexes(connection)
+    return counts
+
+@app.cli.command('seed-db')
+@click.option('--customers', default=10000, show_default=True)
+@click.option('--transactions', default=200000, show_default=True, help='Deposits, withdrawals and transfers to generate; a transfer writes two postings.')
+@click.option('--loans', default=2000, show_default=True)
+@click.option('--days', default=365, show_default=True, help='Length of the generated history.')
+@click.option('--seed', default=42, show_default=True, help='Random seed, so a dataset can be generated again.')
+@click.option('--password', default='password', show_default=True, help='Password of every generated customer.')
+@click.option('--distinct-passwords', is_flag=True, help='Give each customer password + customer id; much slower, as every hash is computed.')
+@click.option('--hash-workers', default=os.cpu_count() or 1, show_default=True, help='Processes hashing distinct passwords.')
+@click.option('--chunk-size', default=SEED_CHUNK_SIZE, show_default=True, help='Rows per insert transaction.')
+@click.option('--reset', is_flag=True, help='Delete all customers, accounts, postings and loans first (admins are kept).')
+@click.option('--yes', is_flag=True, help='Do not ask before --reset.')
+def seed_db_command(customers, transactions, loans, days, seed, password, distinct_passwords, hash_workers, chunk_size, reset, yes):
+    """Bulk-load a generated dataset for performance tests or a staging refresh.
+
+    Running servers keep cached sessions and customer context; restart them after --reset.
+    """
+    if reset:
+        if not yes:
+            click.confirm(f"Delete all customer data in {db.engine.url.render_as_string()}?", abort=True)
+        with db.engine.begin() as connection:
+            drop_search_triggers(connection)
+            for table in reversed(db.metadata.sorted_tables):
+                if table.name not in SEED_KEPT_TABLES:
+                    connection.execute(table.delete())
+    started = time.perf_counter()
+    counts = seed_bank_data(db.engine, customers, transactions, loans, days=days, seed=seed, password=password,
+                            distinct_passwords=distinct_passwords, hash_workers=hash_workers, chunk_size=chunk_size,
+                            progress=lambda message: print(f"[{time.perf_counter() - started:7.1f}s] {message}"))
+    print(f"Seeded {counts['customers']} customers, {counts['accounts']} accounts, {counts['transactions']} postings, "
+          f"{counts['loans']} loans and {counts['repayments']} repayments in {time.perf_counter() - started:.1f}s.")
+
+
+# --- Route Benchmarks ---
+# bench-routes seeds a scratch database, then starts worker processes running this app
+# against it (through DATABASE_URL) that drive the real routes with the test client.
+# Latency percentiles are compared with a stored baseline so regressions show up before
+# a deploy.
+
+BENCH_ROUTES = ('customer_login', 'customer_deposit', 'customer_transfer',
+                'customer_view_account_transactions', 'admin_dashboard', 'admin_view_transactions')
+BENCH_PASSWORD = 'bench-password'
+BENCH_ADMIN_USERNAME = 'bench-admin'
+
+def scratch_worker_env(database_uri, tmp_dir, **overrides):
+    """Environment for a worker process running this app against a seeded scratch database."""
+    # Postings in the scratch database must never reach the real outbox sinks: their
+    # event ids would collide with real ones that consumers dedupe on
+    return dict(os.environ, DATABASE_URL=database_uri, REPLICA_MODE='off', SLOW_REQUEST_MS='0', PASSWORD_HASH_WORKERS='0',
+                SESSION_STORE_PATH=os.path.join(tmp_dir, 'sessions.db'),
+                OUTBOX_DISPATCHER='off', OUTBOX_SINKS='', OUTBOX_FILE_PATH=os.path.join(tmp_dir, 'outbox.ndjson'),
+                INITIAL_ADMIN_USERNAME=BENCH_ADMIN_USERNAME, INITIAL_ADMIN_PASSWORD=BENCH_PASSWORD, **overrides)
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def drive_routes(requests_per_route, seed):
+    """Runs in a worker process: returns {route: [seconds, ...]} and the time spent driving."""
+    rng = random.Random(seed)
+    accounts = db.session.query(Account.id, Account.account_number, Customer.contact_info).join(Customer).all()
+    db.session.remove()
+    latencies = {route: [] for route in BENCH_ROUTES}
+
+    def timed(route, call):
+        started = time.perf_counter()
+        response = call()
+        latencies[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise click.ClickException(f"{route} answered {response.status_code}")
+
+    admin_client = app.test_client()
+    admin_client.post('/admin/login', data={'username': BENCH_ADMIN_USERNAME, 'password': BENCH_PASSWORD})
+    started = time.perf_counter()
+    for _ in range(requests_per_route):
+        account_id, account_number, contact_info = rng.choice(accounts)
+        target_number = rng.choice(accounts)[1]
+        customer_client = app.test_client() # A fresh session, as login turns away logged-in customers
+        timed('customer_login', lambda: customer_client.post('/login', data={'contact_info': contact_info, 'password': BENCH_PASSWORD}))
+        timed('customer_deposit', lambda: customer_client.post(f'/account/{account_id}/deposit', data={'amount': '10.00'}))
+        timed('customer_transfer', lambda: customer_client.post(f'/account/{account_id}/transfer', data={
+            'target_account_number': target_number, 'amount': '1.00', 'description': 'Bench transfer'}))
+        timed('customer_view_account_transactions', lambda: customer_client.get(f'/account/{account_id}/transactions'))
+        timed('admin_dashboard', lambda: admin_client.get('/admin/dashboard'))
+        timed('admin_view_transactions', lambda: admin_client.get('/admin/transactions'))
+    return latencies, time.perf_counter() - started
+
+@app.cli.command('bench-routes-worker', hidden=True)
+@click.option('--requests', 'requests_per_route', type=int, required=True)
+@click.option('--seed', type=int, required=True)
+@click.option('--output', type=click.Path(), required=True)
+def bench_routes_worker_command(requests_per_route, seed, output):
+    # Runs against a scratch database: never start the outbox dispatcher or deliver anywhere
+    app.config['OUTBOX_DISPATCHER'] = 'off'
+    app.config['OUTBOX_SINKS'] = ''
+    latencies, elapsed = drive_routes(requests_per_route, seed)
+    with open(output, 'w') as f:
+        json.dump({'latencies': latencies, 'elapsed': elapsed}, f)
+
+@app.cli.command('bench-routes')
+@click.option('--customers', default=1000, show_default=True, help='Customers to seed.')
+@click.option('--transactions-per-account', default=20, show_default=True, help='Average postings to seed per account.')
+@click.option('--loans', default=200, show_default=True, help='Loans to seed.')
+@click.option('--requests', 'requests_per_route', default=50, show_default=True, help='Requests per route in each worker.')
+@click.option('--processes', default=1, show_default=True, help='Worker processes driving the routes at the same time.')
+@click.option('--seed', default=42, show_default=True, help='Random seed, so runs are reproducible.')
+@click.option('--baseline', 'baseline_path', type=click.Path(), default=None, help='Baseline file (default: instance/bench-baseline.json).')
+@click.option('--save-baseline', is_flag=True, help='Store this run as the new baseline.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed p95 slowdown against the baseline, as a fraction.')
+def bench_routes_command(customers, transactions_per_account, loans, requests_per_route, processes, seed, baseline_path, save_baseline, tolerance):
+    """Measure route latency percentiles and throughput against seeded data and compare with a baseline.
+
+    Runs against a throwaway SQLite file, not bank.db.
+    """
+    baseline_path = baseline_path or os.path.join(app.instance_path, 'bench-baseline.json')
+    settings = {'customers': customers, 'transactions_per_account': transactions_per_account, 'loans': loans,
+                'requests': requests_per_route, 'processes': processes, 'seed': seed}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_uri = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+        scratch_app = create_scratch_app(database_uri)
+        started = time.perf_counter()
+        with scratch_app.app_context():
+            counts = seed_bank_data(db.engine, customers, customers * transactions_per_account, loans, seed=seed, password=BENCH_PASSWORD)
+            db.engine.dispose()
+        print(f"Seeded {counts['customers']} customers, {counts['accounts']} accounts, {counts['transactions']} postings "
+              f"and {counts['loans']} loans in {time.perf_counter() - started:.1f}s")
+
+        env = scratch_worker_env(database_uri, tmp_dir)
+        workers = []
+        for worker in range(processes):
+            output = os.path.join(tmp_dir, f'worker-{worker}.json')
+            command = [sys.executable, '-m', 'flask', '--app', os.path.abspath(__file__), 'bench-routes-worker',
+                       '--requests', str(requests_per_route), '--seed', str(seed + worker), '--output', output]
+            workers.append((subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL), output))
+        results = []
+        for process, output in workers:
+            if process.wait() != 0:
+                raise click.ClickException('A benchmark worker failed.')
+            with open(output) as f:
+                results.append(json.load(f))
+
+    elapsed = max(result['elapsed'] for result in results)
+    total_requests = sum(len(latencies) for result in results for latencies in result['latencies'].values())
+    print(f"{processes} process(es), {total_requests} requests in {elapsed:.2f}s: {total_requests / elapsed:.1f} req/s overall")
+
+    routes = {}
+    for route in BENCH_ROUTES:
+        latencies = sorted(value for result in results for value in result['latencies'][route])
+        routes[route] = {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            # Not measured: the routes run interleaved, so this is what the route alone could
+            # sustain at its mean latency. The measured throughput is the overall figure above.
+            'latency_rps': processes / statistics.fmean(latencies),
+        }
+
+    baseline = None
+    if os.path.exists(baseline_path) and not save_baseline:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print(f"Not comparing: the baseline was recorded with different settings: {baseline['settings']}")
+            baseline = None
+
+    regressions = []
+    print(f"{'Route':<36} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'~req/s*':>8} {'p95 vs baseline':>16}")
+    for route, stats in routes.items():
+        comparison = ''
+        if baseline and route in baseline['routes']:
+            change = stats['p95'] / baseline['routes'][route]['p95'] - 1
+            comparison = f"{change:+.0%}"
+            if change > tolerance:
+                regressions.append(route)
+                comparison += ' SLOWER'
+        print(f"{route:<36} {stats['p50'] * 1000:>8.2f} {stats['p95'] * 1000:>8.2f} {stats['p99'] * 1000:>8.2f} {stats['latency_rps']:>8.1f} {comparison:>16}")
+    print(f"* Derived from latency ({processes} process(es) / mean latency), not measured; see the overall req/s above.")
+
+    if save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump({'settings': settings, 'recorded_at': datetime.utcnow().isoformat(), 'routes': routes}, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+    elif not os.path.exists(baseline_path):
+        print(f"No baseline at {baseline_path}; run with --save-baseline to record one.")
+    if regressions:
+        print(f"FAIL: p95 latency regressed by more than {tolerance:.0%} on {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+# --- Query Budgets ---
+# Pages that list rows must cost a fixed number of queries however many rows they show.
+# check-query-budgets seeds a scratch database, then a worker process fetches each view
+# below inside assert_max_queries(); an N+1 regression pushes a view over its budget and
+# fails the command, so it can run in CI. The customer context cache is switched off, so
+# the dashboard is measured building its context from the database.
+
+QUERY_BUDGETS = (
+    # (endpoint, path, logged in as, max queries)
+    ('customer_dashboard', '/dashboard', 'customer', 4),
+    ('customer_view_account_transactions', '/account/{account_id}/transactions', 'customer', 3),
+    ('customer_export_statement', '/account/{account_id}/statement', 'customer', 3),
+    ('admin_view_customers', '/admin/customers', 'admin', 3),
+    ('admin_view_customer_details', '/admin/customer/{customer_id}', 'admin', 5),
+    ('admin_view_accounts', '/admin/accounts', 'admin', 2),
+    ('admin_view_transactions', '/admin/transactions', 'admin', 2),
+    ('admin_view_loans', '/admin/loans', 'admin', 2),
+    ('admin_export_statement', '/admin/statement', 'admin', 2),
+)
+
+def check_query_budgets():
+    """Runs in a worker process: returns one result per QUERY_BUDGETS entry."""
+    # The busiest account, so per-row queries would show up clearly
+    account_id, contact_info = (db.session.query(Transaction.account_id, Customer.contact_info)
+                                .join(Account, Transaction.account_id == Account.id).join(Customer)
+                                .group_by(Transaction.account_id, Customer.contact_info)
+                                .order_by(func.count().desc()).first())
+    # The customer with the most loans, for the details page
+    customer_id = db.session.query(Loan.customer_id).group_by(Loan.customer_id).order_by(func.count().desc()).limit(1).scalar()
+    db.session.remove()
+    clients = {'customer': app.test_client(), 'admin': app.test_client()}
+    clients['customer'].post('/login', data={'contact_info': contact_info, 'password': BENCH_PASSWORD})
+    clients['admin'].post('/admin/login', data={'username': BENCH_ADMIN_USERNAME, 'password': BENCH_PASSWORD})
+
+    results = []
+    for endpoint, path, role, budget in QUERY_BUDGETS:
+        failure = None
+        try:
+            with assert_max_queries(budget) as statements:
+                response = clients[role].get(path.format(account_id=account_id, customer_id=customer_id))
+                response.get_data() # Streamed pages run their queries while the body is read
+        except AssertionError as e:
+            failure = str(e)
+        if response.status_code != 200:
+            failure = f"{path} answered {response.status_code}"
+        results.append({'endpoint': endpoint, 'queries': len(statements), 'budget': budget, 'failure': failure})
+    return results
+
+@app.cli.command('check-query-budgets-worker', hidden=True)
+@click.option('--output', type=click.Path(), required=True)
+def check_query_budgets_worker_command(output):
+    app.config['OUTBOX_DISPATCHER'] = 'off'
+    app.config['OUTBOX_SINKS'] = ''
+    with open(output, 'w') as f:
+        json.dump(check_query_budgets(), f)
+
+@app.cli.command('check-query-budgets')
+@click.option('--customers', default=50, show_default=True, help='Customers to seed.')
+@click.option('--transactions-per-account', default=20, show_default=True, help='Average postings to seed per account.')
+@click.option('--loans', default=20, show_default=True, help='Loans to seed.')
+@click.option('--seed', default=42, show_default=True, help='Random seed.')
+def check_query_budgets_command(customers, transactions_per_account, loans, seed):
+    """Fail if the dashboard, customer list or statement views run more queries than budgeted.
+
+    Runs against a throwaway SQLite file, not bank.db.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_uri = 'sqlite:///' + os.path.join(tmp_dir, 'budgets.db')
+        scratch_app = create_scratch_app(database_uri)
+        with scratch_app.app_context():
+            seed_bank_data(db.engine, customers, customers * transactions_per_account, loans, seed=seed, password=BENCH_PASSWORD)
+            db.engine.dispose()
+        output = os.path.join(tmp_dir, 'budgets.json')
+        command = [sys.executable, '-m', 'flask', '--app', os.path.abspath(__file__), 'check-query-budgets-worker', '--output', output]
+        env = scratch_worker_env(database_uri, tmp_dir, CUSTOMER_CONTEXT_STORE='off', METRICS_ENABLED='0')
+        if subprocess.run(command, env=env, stdout=subprocess.DEVNULL).returncode != 0:
+            raise click.ClickException('The query budget worker failed.')
+        with open(output) as f:
+            results = json.load(f)
+
+    for result in results:
+        verdict = 'OVER BUDGET' if result['failure'] else 'ok'
+        print(f"{result['endpoint']:<36} {result['queries']:>4} / {result['budget']:<4} {verdict}")
+    failures = [result for result in results if result['failure']]
+    for result in failures:
+        print(f"\n{result['endpoint']}: {result['failure']}")
+    if failures:
+        raise SystemExit(1)
+
+
 # --- Database Initialization ---
 with app.app_context():
-    db.create_all()
+    create_schema()
     print("Database and tables created (or already exist)!")
 
     initial_admin_username = os.environ.get('INITIAL_ADMIN_USERNAME', 'admin')